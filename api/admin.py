@@ -1,8 +1,13 @@
 from django.contrib import admin
 
-from api.models import Player, Game
+from api.models import Player, Game, Session, Round, GroupSession, GroupRound, ChatMessage
 
 # Register your models here.
 
 admin.site.register(Player)
 admin.site.register(Game)
+admin.site.register(Session)
+admin.site.register(Round)
+admin.site.register(GroupSession)
+admin.site.register(GroupRound)
+admin.site.register(ChatMessage)
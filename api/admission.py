@@ -0,0 +1,280 @@
+import os
+import socket
+import threading
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+
+WORKERS_KEY = "admission_workers"
+WAITING_KEY = "waiting_channels"
+# Worker entries expire unless refreshed within this many seconds
+TTL = 120
+# Waiting channels are removed on disconnect, this only drops those of crashed workers
+WAITING_TTL = 60 * 15
+
+# The waiting room is a sorted set of channels by queue order, next to a sorted set of their expiry times.
+# Scripts drop expired channels first.
+#   KEYS: queue, expiry
+#   ARGV: now, ...
+DROP_EXPIRED = """
+for _, channel in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])) do
+    redis.call('ZREM', KEYS[1], channel)
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+"""
+
+# Queues a channel at the back, or the front, and returns its position.
+#   ARGV: now, channel, '1' for the front, expiry, key TTL
+ADD_SCRIPT = DROP_EXPIRED + """
+redis.call('ZREM', KEYS[1], ARGV[2])
+local score = 0
+if ARGV[3] == '1' then
+    local first = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    if first[2] then score = tonumber(first[2]) - 1 end
+else
+    local last = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+    if last[2] then score = tonumber(last[2]) + 1 end
+end
+redis.call('ZADD', KEYS[1], score, ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+return redis.call('ZRANK', KEYS[1], ARGV[2]) + 1
+"""
+
+# Takes channels from the front of the queue.
+#   ARGV: now, index of the last channel to take (-1 for all)
+POP_SCRIPT = DROP_EXPIRED + """
+local channels = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[2]))
+for _, channel in ipairs(channels) do
+    redis.call('ZREM', KEYS[1], channel)
+    redis.call('ZREM', KEYS[2], channel)
+end
+return channels
+"""
+
+# Admitted players are counted in a hash with a "connections expiry" field per worker, written only by
+# that worker. Sums the fields that have not expired and drops the others.
+#   KEYS: workers
+#   ARGV: now
+CONNECTIONS_SCRIPT = """
+local total = 0
+local fields = redis.call('HGETALL', KEYS[1])
+for i = 1, #fields, 2 do
+    local connections, expiry = string.match(fields[i + 1], '(%d+) (%d+)')
+    if tonumber(expiry) > tonumber(ARGV[1]) then
+        total = total + tonumber(connections)
+    else
+        redis.call('HDEL', KEYS[1], fields[i])
+    end
+end
+return total
+"""
+
+# Guards the in-process fallbacks' read-modify-writes of the cache
+_lock = threading.Lock()
+
+
+def now():
+    return int(datetime.now().timestamp())
+
+
+def redis_client():
+    """The cache's Redis client, or None when the cache is in process (single-node mode)"""
+    if settings.CACHES["default"]["BACKEND"] != "django.core.cache.backends.redis.RedisCache":
+        return None
+    return cache._cache.get_client(write=True)
+
+
+class Admission:
+    """
+    Decides whether a connecting player may enter the lobby. Players are
+    counted from the time they enter the lobby until they disconnect, per
+    worker and, through the cache, for the whole cluster. Every limit is
+    optional; `None` means unlimited.
+    """
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.lock = threading.Lock()
+        self.connections = set()
+        self.lobby = set()
+        self.timer = None
+        # Without caps nobody ever waits, and the waiting room is never read
+        self.limited = any(v is not None for k, v in limits.items() if k != "WAITING_ROOM")
+
+    def has_room(self, cluster_lobby):
+        """Whether one more player may enter the lobby, given the cluster lobby size"""
+        return self.room(cluster_lobby) > 0
+
+    def room(self, cluster_lobby):
+        """How many more players may enter the lobby"""
+        limits = self.limits
+        with self.lock:
+            room = [
+                _left(limits["WORKER_CONNECTIONS"], len(self.connections)),
+                _left(limits["WORKER_LOBBY"], len(self.lobby)),
+            ]
+        room.append(_left(limits["CLUSTER_LOBBY"], cluster_lobby))
+        if limits["CLUSTER_CONNECTIONS"] is not None:
+            room.append(_left(limits["CLUSTER_CONNECTIONS"], self.cluster_connections()))
+        room = [r for r in room if r is not None]
+        return min(room) if room else float("inf")
+
+    def enter_lobby(self, channel_name):
+        with self.lock:
+            self.connections.add(channel_name)
+            self.lobby.add(channel_name)
+        self.publish()
+
+    def admit(self, channel_name):
+        """Counts a player that rejoins a game directly, without going through the lobby"""
+        with self.lock:
+            self.connections.add(channel_name)
+        self.publish()
+
+    def leave_lobby(self, channel_name):
+        """Returns whether the channel was in this worker's lobby"""
+        with self.lock:
+            in_lobby = channel_name in self.lobby
+            self.lobby.discard(channel_name)
+        return in_lobby
+
+    def release(self, channel_name):
+        """Returns whether the channel was admitted"""
+        with self.lock:
+            admitted = channel_name in self.connections
+            self.connections.discard(channel_name)
+            self.lobby.discard(channel_name)
+        if admitted:
+            self.publish()
+        return admitted
+
+    def cluster_connections(self):
+        client = redis_client()
+        if client is None:
+            workers = cache.get(WORKERS_KEY, {})
+            return sum(w["connections"] for w in workers.values() if w["ttl"] > now())
+
+        return client.eval(CONNECTIONS_SCRIPT, 1, cache.make_key(WORKERS_KEY), now())
+
+    def publish(self):
+        """Writes this worker's count to the cache and keeps it fresh while it has players"""
+        with self.lock:
+            connections = len(self.connections)
+
+        client = redis_client()
+        if client is None:
+            with _lock:
+                workers = {k: v for k, v in cache.get(WORKERS_KEY, {}).items() if v["ttl"] > now()}
+                if connections:
+                    workers[self.worker_id] = {"connections": connections, "ttl": now() + TTL}
+                else:
+                    workers.pop(self.worker_id, None)
+                cache.set(WORKERS_KEY, workers, TTL * 2)
+        else:
+            key = cache.make_key(WORKERS_KEY)
+            pipe = client.pipeline()
+            if connections:
+                pipe.hset(key, self.worker_id, f"{connections} {now() + TTL}")
+            else:
+                pipe.hdel(key, self.worker_id)
+            pipe.expire(key, TTL * 2)
+            pipe.execute()
+
+        with self.lock:
+            if connections and self.timer is None:
+                self.timer = threading.Timer(TTL / 3, self._refresh)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _refresh(self):
+        with self.lock:
+            self.timer = None
+        self.publish()
+
+
+def _left(limit, used):
+    return None if limit is None else limit - used
+
+
+class Waiting:
+    """
+    FIFO of channels waiting for room in the lobby, shared by the cluster.
+    On Redis every change is a single command or script, so concurrent
+    workers can't lose or reorder entries.
+    """
+
+    @staticmethod
+    def keys():
+        return [cache.make_key(WAITING_KEY), cache.make_key(f"{WAITING_KEY}:expiry")]
+
+    @staticmethod
+    def all() -> list:
+        client = redis_client()
+        if client is None:
+            return [e["channel"] for e in cache.get(WAITING_KEY, []) if e["ttl"] > now()]
+
+        queue, expiry = Waiting.keys()
+        pipe = client.pipeline()
+        pipe.zrange(queue, 0, -1)
+        pipe.zrangebyscore(expiry, f"({now()}", "+inf")
+        channels, live = pipe.execute()
+        live = set(live)
+        return [c.decode() for c in channels if c in live]
+
+    @staticmethod
+    def add(name, front=False):
+        client = redis_client()
+        if client is not None:
+            return client.eval(ADD_SCRIPT, 2, *Waiting.keys(),
+                               now(), name, "1" if front else "0", now() + WAITING_TTL, WAITING_TTL * 2)
+
+        with _lock:
+            queue = [e for e in cache.get(WAITING_KEY, []) if e["ttl"] > now() and e["channel"] != name]
+            entry = {"channel": name, "ttl": now() + WAITING_TTL}
+            if front:
+                queue.insert(0, entry)
+            else:
+                queue.append(entry)
+            cache.set(WAITING_KEY, queue, WAITING_TTL * 2)
+        return queue.index(entry) + 1
+
+    @staticmethod
+    def position(name):
+        queue = Waiting.all()
+        return queue.index(name) + 1 if name in queue else None
+
+    @staticmethod
+    def pop(count) -> list:
+        if count <= 0:
+            return []
+        client = redis_client()
+        if client is not None:
+            last = -1 if count == float("inf") else int(count) - 1
+            return [c.decode() for c in client.eval(POP_SCRIPT, 2, *Waiting.keys(), now(), last)]
+
+        with _lock:
+            queue = [e for e in cache.get(WAITING_KEY, []) if e["ttl"] > now()]
+            if not queue:
+                return []
+            count = min(count, len(queue))
+            cache.set(WAITING_KEY, queue[count:], WAITING_TTL * 2)
+        return [e["channel"] for e in queue[:count]]
+
+    @staticmethod
+    def delete(name):
+        client = redis_client()
+        if client is not None:
+            queue, expiry = Waiting.keys()
+            pipe = client.pipeline()
+            pipe.zrem(queue, name)
+            pipe.zrem(expiry, name)
+            pipe.execute()
+            return
+
+        with _lock:
+            queue = cache.get(WAITING_KEY, [])
+            cache.set(WAITING_KEY, [e for e in queue if e["channel"] != name], WAITING_TTL * 2)
@@ -0,0 +1,253 @@
+"""
+Offline analysis over the rounds played by humans. Rounds are loaded in
+chunks into NumPy arrays and folded into a `RoundStats` per month of play,
+whose aggregates can be extended with newer rounds and merged. Repeated runs
+only load what changed: a month whose rounds all came after the ones already
+folded in is extended, and a month that got rounds dated earlier (restored
+archives, converted legacy rounds) is loaded again.
+
+The per-month stats are pickled to ANALYSIS_STATE_FILE rather than the Django
+cache, which is per-process under SINGLE_NODE and would be empty on every run.
+"""
+import os
+import pickle
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Case, Count, Max, Value, When
+from django.db.models.functions import TruncMonth
+
+from api.games import GAME_LIST
+from api.models import Game, Round
+
+GAMES = [g for g in GAME_LIST if g.game_id != 0]
+GAME_INDEX = {g.game_name: i for i, g in enumerate(GAMES)}
+COOPERATIVE = np.array([g.cooperative for g in GAMES], dtype=object)
+
+# Treatments are encoded as bitmasks of the info types shown to the pair
+INFO_BITS = {Game.InfoType.INFO: 1, Game.InfoType.CHAT: 2, Game.InfoType.VIDEO: 4}
+TREATMENTS = 1 << len(INFO_BITS)
+
+PAYOFF_EDGES = np.arange(-20, 40.5, 0.5)
+
+FIELDS = ["game_name", "treatment", "server_choice", "client_choice", "server_amount", "client_amount",
+          "server_know", "client_know", "server_payoff", "client_payoff"]
+
+
+def treatment_mask():
+    """The treatment bitmask of each round's session, computed by the database"""
+    return sum(
+        (Case(When(session__info_type__contains=[info_type], then=Value(bit)), default=Value(0))
+         for info_type, bit in INFO_BITS.items()),
+        Value(0)
+    )
+
+
+def human_rounds():
+    # Rounds with a bot, including the synthetic sessions of `simulate_sessions`, would mix in scripted strategies
+    return Round.objects.filter(session__with_bot=False)
+
+
+def load_chunks(rounds, chunk_size=10000):
+    """Yields dicts of column arrays for the rounds of queryset `rounds`"""
+    rows = []
+    for row in rounds.annotate(treatment=treatment_mask()).order_by("created_at").values_list(*FIELDS).iterator(chunk_size=chunk_size):
+        rows.append(row)
+        if len(rows) == chunk_size:
+            yield to_arrays(rows)
+            rows = []
+    if rows:
+        yield to_arrays(rows)
+
+
+def to_arrays(rows):
+    table = np.array(rows, dtype=object).reshape(len(rows), len(FIELDS))
+    columns = dict(zip(FIELDS, table.T))
+    # Game names are looked up once per distinct name, then mapped back onto the rows
+    names, inverse = np.unique(columns["game_name"], return_inverse=True)
+    game_index = np.array([GAME_INDEX.get(name, -1) for name in names], dtype=np.int64)
+    return {
+        "game": game_index[inverse.ravel()],
+        "treatment": columns["treatment"].astype(np.int64),
+        "choice": np.stack([columns["server_choice"], columns["client_choice"]]),
+        # None becomes nan
+        "amount": np.array([columns["server_amount"], columns["client_amount"]], dtype=float),
+        "know": np.array([columns["server_know"], columns["client_know"]], dtype=float),
+        "payoff": np.array([columns["server_payoff"], columns["client_payoff"]], dtype=float),
+    }
+
+
+class RoundStats:
+    """Mergeable aggregates: cooperation counts, payoff histograms and outro trust"""
+
+    def __init__(self):
+        self.rounds = 0
+        # [game, treatment] -> player actions, and how many of them were cooperative
+        self.acted = np.zeros((len(GAMES), TREATMENTS), dtype=np.int64)
+        self.cooperated = np.zeros((len(GAMES), TREATMENTS), dtype=np.int64)
+        # [game] -> payoff histogram over PAYOFF_EDGES, plus moments for exact mean/std
+        self.payoff_hist = np.zeros((len(GAMES), len(PAYOFF_EDGES) - 1), dtype=np.int64)
+        self.payoff_moments = np.zeros((len(GAMES), 3))
+        # One row per outro round: server/client trust, server/client know, treatment
+        self.outro = np.zeros((0, 5))
+
+    def add(self, chunk):
+        valid = chunk["game"] >= 0
+        game, treatment = chunk["game"][valid], chunk["treatment"][valid]
+        choice, payoff = chunk["choice"][:, valid], chunk["payoff"][:, valid]
+        self.rounds += int(valid.sum())
+
+        cooperative = COOPERATIVE[game]
+        binary = cooperative != None  # noqa: E711, elementwise
+        for role in range(2):
+            acted = binary & (choice[role] != None)  # noqa: E711
+            np.add.at(self.acted, (game[acted], treatment[acted]), 1)
+            cooperated = acted & (choice[role] == cooperative)
+            np.add.at(self.cooperated, (game[cooperated], treatment[cooperated]), 1)
+
+        for role in range(2):
+            scored = ~np.isnan(payoff[role])
+            g, p = game[scored], payoff[role][scored]
+            bins = np.clip(np.digitize(p, PAYOFF_EDGES) - 1, 0, len(PAYOFF_EDGES) - 2)
+            np.add.at(self.payoff_hist, (g, bins), 1)
+            np.add.at(self.payoff_moments, (g, 0), 1)
+            np.add.at(self.payoff_moments, (g, 1), p)
+            np.add.at(self.payoff_moments, (g, 2), p ** 2)
+
+        outro = game == GAME_INDEX["outro"]
+        rows = np.column_stack([
+            chunk["amount"][0][valid][outro], chunk["amount"][1][valid][outro],
+            chunk["know"][0][valid][outro], chunk["know"][1][valid][outro],
+            treatment[outro]
+        ])
+        self.outro = np.concatenate([self.outro, rows])
+
+    def merge(self, other):
+        self.rounds += other.rounds
+        self.acted += other.acted
+        self.cooperated += other.cooperated
+        self.payoff_hist += other.payoff_hist
+        self.payoff_moments += other.payoff_moments
+        self.outro = np.concatenate([self.outro, other.outro])
+
+    def cooperation_rates(self):
+        def rate(cooperated, acted):
+            return None if acted == 0 else float(cooperated / acted)
+
+        per_game = {
+            g.game_name: rate(self.cooperated[i].sum(), self.acted[i].sum())
+            for i, g in enumerate(GAMES) if g.cooperative is not None
+        }
+
+        masks = np.arange(TREATMENTS)
+        per_info_type = {}
+        for info_type, bit in INFO_BITS.items():
+            shown = (masks & bit) != 0
+            per_info_type[info_type] = {
+                "with": rate(self.cooperated[:, shown].sum(), self.acted[:, shown].sum()),
+                "without": rate(self.cooperated[:, ~shown].sum(), self.acted[:, ~shown].sum()),
+            }
+
+        return {"per_game": per_game, "per_info_type": per_info_type}
+
+    def payoff_distributions(self):
+        results = {}
+        for i, g in enumerate(GAMES):
+            n, total, squares = self.payoff_moments[i]
+            if n == 0:
+                continue
+            mean = total / n
+            cumulative = np.cumsum(self.payoff_hist[i]) / n
+            results[g.game_name] = {
+                "count": int(n),
+                "mean": float(mean),
+                "std": float(np.sqrt(max(squares / n - mean ** 2, 0))),
+                # Payoffs are multiples of 0.5 in all but the investment game, so the bin edges are exact there
+                "quartiles": [float(PAYOFF_EDGES[np.searchsorted(cumulative, q)]) for q in (0.25, 0.5, 0.75)],
+            }
+        return results
+
+    def trust_metrics(self):
+        rows = self.outro[~np.isnan(self.outro[:, :2]).any(axis=1)]
+        if len(rows) == 0:
+            return None
+
+        trust, know, treatment = rows[:, :2], rows[:, 2:4], rows[:, 4].astype(int)
+        given = trust.ravel()
+        knows = know.ravel() == 1
+        reciprocity = np.corrcoef(trust[:, 0], trust[:, 1])[0, 1] if len(rows) > 1 else np.nan
+
+        return {
+            "pairs": len(rows),
+            "mean_trust": float(given.mean()),
+            "reciprocity": None if np.isnan(reciprocity) else float(reciprocity),
+            "mean_asymmetry": float(np.abs(trust[:, 0] - trust[:, 1]).mean()),
+            "know_rate": float(knows.mean()),
+            "mean_trust_known": float(given[knows].mean()) if knows.any() else None,
+            "mean_trust_unknown": float(given[~knows].mean()) if (~knows).any() else None,
+            "mean_trust_per_info_type": {
+                info_type: float(trust[(treatment & bit) != 0].mean()) if ((treatment & bit) != 0).any() else None
+                for info_type, bit in INFO_BITS.items()
+            },
+        }
+
+    def results(self):
+        return {
+            "rounds": self.rounds,
+            "cooperation": self.cooperation_rates(),
+            "payoffs": self.payoff_distributions(),
+            "trust": self.trust_metrics(),
+        }
+
+
+def next_month(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def load_state():
+    try:
+        with open(settings.ANALYSIS_STATE_FILE, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(state):
+    path = settings.ANALYSIS_STATE_FILE
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def analyze(rebuild=False, chunk_size=10000):
+    """
+    Results over all human rounds. Stats are saved per month with the number
+    of rounds and the latest `created_at` included, which one aggregate query
+    compares with the database to find the months to load.
+    """
+    months = (human_rounds().annotate(month=TruncMonth("created_at")).values("month")
+              .annotate(count=Count("round_id"), latest=Max("created_at")).order_by("month"))
+    cached = {} if rebuild else load_state()
+
+    updated, total = {}, RoundStats()
+    for row in months:
+        month, entry = row["month"], cached.get(row["month"])
+        rounds = human_rounds().filter(created_at__gte=month, created_at__lt=next_month(month))
+
+        if entry is None or entry["count"] != row["count"] or entry["latest"] != row["latest"]:
+            if entry is not None and rounds.filter(created_at__lte=entry["latest"]).count() == entry["count"]:
+                # Only rounds newer than the cached ones were added
+                stats, rounds = entry["stats"], rounds.filter(created_at__gt=entry["latest"])
+            else:
+                stats = RoundStats()
+            for chunk in load_chunks(rounds, chunk_size):
+                stats.add(chunk)
+            entry = {"count": row["count"], "latest": row["latest"], "stats": stats}
+
+        updated[month] = entry
+        total.merge(entry["stats"])
+
+    save_state(updated)
+    return total.results()
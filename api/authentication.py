@@ -1,8 +1,6 @@
 import logging
 import os
 
-from google.auth.transport import requests
-from google.oauth2 import id_token
 from rest_framework import authentication
 from rest_framework import exceptions
 
@@ -17,6 +15,9 @@ class GoogleJWTAuthentication(authentication.BaseAuthentication):
             raise exceptions.AuthenticationFailed("No Token Provided")
 
         token = header.split(" ")[1]
+        # Loaded on first use, see api.utils
+        from google.auth.transport import requests
+        from google.oauth2 import id_token
         try:
             info = id_token.verify_oauth2_token(token, requests.Request(), os.environ['CLIENT_ID'])
             return info, None
@@ -0,0 +1,93 @@
+import random
+from typing import Dict, Type
+
+from api.games import BaseGame
+from api.lobby import LobbyEntry
+from api.models import Player
+
+
+class Strategy:
+    """Picks a bot's action for a game given the opponent's actions in earlier games"""
+
+    def act(self, game: BaseGame, history):
+        return game.config.get("default")
+
+
+class DefaultStrategy(Strategy):
+    pass
+
+
+class RandomStrategy(Strategy):
+    def act(self, game: BaseGame, history):
+        if game.choices:
+            return random.choice(game.choices)
+        return super(RandomStrategy, self).act(game, history)
+
+
+class CooperativeStrategy(Strategy):
+    def act(self, game: BaseGame, history):
+        if game.cooperative is not None:
+            return game.cooperative
+        return super(CooperativeStrategy, self).act(game, history)
+
+
+class TitForTatStrategy(Strategy):
+    """Cooperates first, then cooperates iff the opponent did in the last game that had a cooperative action"""
+
+    def act(self, game: BaseGame, history):
+        if game.cooperative is None:
+            return super(TitForTatStrategy, self).act(game, history)
+
+        previous = [(g, a) for g, a in history if g.cooperative is not None]
+        if not previous or previous[-1][1] == previous[-1][0].cooperative:
+            return game.cooperative
+        return next(c for c in game.choices if c != game.cooperative)
+
+
+STRATEGIES: Dict[str, Type[Strategy]] = {
+    "default": DefaultStrategy,
+    "random": RandomStrategy,
+    "cooperative": CooperativeStrategy,
+    "tit_for_tat": TitForTatStrategy,
+}
+
+_bot_players: Dict[str, Player] = {}
+
+
+def get_bot_player(strategy, seat=0) -> Player:
+    """
+    The Player row bots with `strategy` are saved as, created on first use.
+    Bots playing each other with the same strategy take different seats.
+    """
+    email = f"{strategy}-{seat}@bots.mtp"
+    if email not in _bot_players:
+        _bot_players[email], _ = Player.objects.get_or_create(
+            email=email,
+            defaults={"name": f"Bot ({strategy})", "is_bot": True}
+        )
+    return _bot_players[email]
+
+
+class Bot:
+    def __init__(self, player: LobbyEntry, strategy: Strategy, channel_name):
+        self.player = player
+        self.player.channel_name = channel_name
+        self.strategy = strategy
+        self.history = []
+
+    @staticmethod
+    def create(strategy_name, channel_name, seat=0):
+        return Bot(LobbyEntry.of(get_bot_player(strategy_name, seat)), STRATEGIES[strategy_name](), channel_name)
+
+    def move(self, game: BaseGame):
+        """A game event as sent by a client, for the consumer hosting the bot"""
+        return {
+            "type": "game_update",
+            "data": self.strategy.act(game, self.history),
+            "sender": self.player.channel_name
+        }
+
+    def observe(self, game: BaseGame):
+        """Records the opponent's action once `game` is complete"""
+        opponent = game.client if game.server.email == self.player.email else game.server
+        self.history.append((type(game), game.state.get(opponent.email)))
@@ -0,0 +1,83 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from api.models import ChatMessage
+
+
+class ChatBuffer:
+    """
+    Collects chat messages of all groups on this worker and writes them with a
+    single bulk insert once `max_size` messages are pending. A timer writes
+    each group's messages once its oldest has waited `max_age` seconds, also
+    when the group has gone quiet. Groups are also flushed when they are
+    torn down.
+    """
+
+    def __init__(self, max_size, max_age):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.pending = {}
+        # When the oldest pending message of each group was added
+        self.oldest = {}
+        self.size = 0
+        self.timer = None
+
+    def add(self, group_id, sender_email, message):
+        with self.lock:
+            self.pending.setdefault(group_id, []).append(
+                ChatMessage(group_id=group_id, sender_id=sender_email, message=message)
+            )
+            self.oldest.setdefault(group_id, time.monotonic())
+            self.size += 1
+            full = self.size >= self.max_size
+            if self.timer is None:
+                self.schedule(self.max_age)
+
+        if full:
+            self.flush()
+
+    def flush(self, group_id=None):
+        with self.lock:
+            messages = self.take(list(self.pending) if group_id is None else [group_id])
+        self.write(messages)
+
+    def flush_due(self):
+        """Writes the groups whose oldest message has waited `max_age`, then waits for the next one"""
+        now = time.monotonic()
+        with self.lock:
+            self.timer = None
+            messages = self.take([g for g, added in self.oldest.items() if now - added >= self.max_age])
+            if self.oldest:
+                self.schedule(max(0.0, min(self.oldest.values()) + self.max_age - now))
+        try:
+            self.write(messages)
+        finally:
+            # The timer thread's connection goes back to the pool
+            connection.close()
+
+    def schedule(self, delay):
+        # Called with the lock held
+        self.timer = threading.Timer(delay, self.flush_due)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def take(self, group_ids):
+        # Called with the lock held
+        messages = []
+        for group_id in group_ids:
+            messages += self.pending.pop(group_id, [])
+            self.oldest.pop(group_id, None)
+        self.size -= len(messages)
+        return messages
+
+    @staticmethod
+    def write(messages):
+        if messages:
+            ChatMessage.objects.bulk_create(messages)
+
+
+chat_buffer = ChatBuffer(settings.CHAT_FLUSH_SIZE, settings.CHAT_FLUSH_INTERVAL)
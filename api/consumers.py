@@ -2,18 +2,28 @@ import logging
 import os
 import pickle
 import random
+import time
 from datetime import datetime
 from typing import List
 
-from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
 from channels.generic.websocket import JsonWebsocketConsumer
-from django.core.cache import cache
+from channels.layers import get_channel_layer
+from django.conf import settings
 from redis.exceptions import ConnectionError
 
-from .games import get_game, BaseGame, GAME_LIST
+from .admission import Admission, Waiting
+from .bots import Bot
+from .chat import chat_buffer
+from .drain import drain, Checkpoint
+from .games import get_game, get_group_game, BaseGame, GroupGame, GAME_LIST
+from .lobby import LobbyEntry
 from .models import Player, Game
-from .serializers import PlayerSerializer
-from .utils import random_str, dumps
+from .profiling import async_to_sync, profiled, timed, sample_profiler, dump_profile
+from .throttling import TokenBucket, backlog
+from .tracing import traced, stamp
+from .transitions import read_lobby, update_lobby, leave_lobby, move_to_group, shards, lobby_group, new_group_name
+from .utils import dumps
 
 log = logging.getLogger(__name__)
 
@@ -26,6 +36,10 @@ class C:
     HANDLE_GAME_EVENT = "handle_game_event"
     CHAT = "chat"
     PLAYER_DISCONNECT = "player_disconnect"
+    THROTTLED = "throttled"
+    WAITING = "waiting"
+    ADMITTED = "admitted"
+    RECONNECT = "reconnect"
 
     WEB_RTC_MEDIA_OFFER = "web_rtc_media_offer"
     WEB_RTC_MEDIA_ANSWER = "web_rtc_media_answer"
@@ -39,52 +53,84 @@ class C:
         WEB_RTC_MEDIA_OFFER,
         WEB_RTC_MEDIA_ANSWER
     ]
-    IGNORE_LOG = WRTC_COMMANDS + [REMOTE_IMAGE_URI]
+    IGNORE_LOG = WRTC_COMMANDS + [REMOTE_IMAGE_URI, CHAT]
+    # Sent by the server only, never forwarded from clients
+    SERVER_ONLY = [THROTTLED, WAITING, ADMITTED, RECONNECT]
 
 
-COMMANDS_LIST = [v for k, v in dict(vars(C)).items() if "__" not in k]
+COMMANDS_LIST = [v for k, v in dict(vars(C)).items() if "__" not in k and v not in C.SERVER_ONLY]
+
+admission = Admission(settings.ADMISSION_LIMITS)
+
+
+def message_class(message_type):
+    if message_type == C.CHAT:
+        return "chat"
+    if message_type in C.WRTC_COMMANDS:
+        return "signaling"
+    if message_type == C.REMOTE_IMAGE_URI:
+        return "image"
+    return "game"
 
 
 class WebRTCSignalingConsumer(JsonWebsocketConsumer):
+    @profiled
+    @traced
     def web_rtc_media_offer(self, event):
         self.send_json(event)
 
+    @profiled
+    @traced
     def web_rtc_media_answer(self, event):
         self.send_json(event)
 
+    @profiled
+    @traced
     def web_rtc_ice_candidate(self, event):
         event["type"] = C.WEB_RTC_REMOTE_PEER_ICE_CANDIDATE
         self.send_json(event)
 
 
 class Active:
+    """This worker's lobby: the cluster's, or its shard's when the channel layer is sharded"""
+
     @staticmethod
     def all():
-        obj = cache.get('active_channels', {})
+        obj = read_lobby(get_channel_layer()).entries
         return {k: v['data'] for k, v in obj.items() if v['ttl'] > int(datetime.now().timestamp())}
 
     @staticmethod
-    def get(name) -> Player:
-        obj = cache.get('active_channels', {})
+    def count():
+        """Players in the lobbies of all shards"""
+        channel_layer = get_channel_layer()
+        return sum(len(read_lobby(channel_layer, shard).players()) for shard in shards(channel_layer))
+
+    @staticmethod
+    def get(name) -> LobbyEntry:
+        obj = read_lobby(get_channel_layer()).entries
         if name in obj and obj[name]['ttl'] > int(datetime.now().timestamp()):
             return obj[name]['data']
         else:
             return None
 
     @staticmethod
-    def set(name, player: Player):
-        obj = cache.get('active_channels', {})
-        obj = {k: v for k, v in obj.items() if v['data'].email != player.email}
-        obj[name] = {'data': player, "ttl": int(datetime.now().timestamp()) + 60 * 15}
-        cache.set('active_channels', obj, 60 * 30)
+    def set(name, player: LobbyEntry):
+        def change(obj):
+            obj = {k: v for k, v in obj.items() if v['data'].email != player.email}
+            obj[name] = {'data': player, "ttl": int(datetime.now().timestamp()) + 60 * 15}
+            return obj
+
+        update_lobby(get_channel_layer(), change)
 
     @staticmethod
     def delete(name):
-        obj = cache.get('active_channels', {})
-        if name in obj:
+        def change(obj):
+            if name not in obj:
+                return None
             del obj[name]
+            return obj
 
-        cache.set('active_channels', obj, 60 * 30)
+        update_lobby(get_channel_layer(), change)
 
 
 class GameConsumer(WebRTCSignalingConsumer):
@@ -92,17 +138,57 @@ class GameConsumer(WebRTCSignalingConsumer):
         super().__init__(args, kwargs)
         self.is_server = False
         self.player: Player = None
-        self.opponent: Player = None
+        self.lobby_entry: LobbyEntry = None
+        self.opponent: LobbyEntry = None
         self.game: BaseGame = None
         self.group_id = None
         self.scores = [0, 0]
-
+        self.bot: Bot = None
+        self.lobby_since = None
+        self.session_data = None
+        self.draining = False
+        self.handed_off = False
+        self.left_group = False
+        self.profiler = None
+        self.buckets = {k: TokenBucket(*v) for k, v in settings.MESSAGE_RATE_LIMITS.items()}
+
+    @profiled
     def connect(self):
+        self.profiler = sample_profiler()
         self.player = self.scope["user"]
         self.player.channel_name = self.channel_name
+        self.lobby_entry = LobbyEntry.of(self.player, self.channel_name)
+
+        if drain.active:
+            self.close()
+            return
+
+        self.accept()
+        drain.register(self.channel_name)
+
+        group_id = Checkpoint.for_player(self.player.email)
+        if group_id is not None and self.resume(group_id):
+            return
+
+        waiting = Waiting.all() if admission.limited else []
+        limit = settings.ADMISSION_LIMITS["WAITING_ROOM"]
+        if limit is not None and len(waiting) >= limit:
+            log.warning(f"Refused {self.player.email}: waiting room full")
+            self.close(code=4503)
+            return
+
+        # Newcomers queue behind players already waiting
+        if admission.limited and (waiting or not admission.has_room(Active.count())):
+            self.wait()
+            self.admit_waiting()
+        else:
+            self.enter_lobby()
 
-        self.add_to_lobby(self.channel_name, self.player, None)
+    def enter_lobby(self):
+        self.add_to_lobby(self.channel_name, self.lobby_entry, None)
         self.group_id = "lobby"
+        self.lobby_since = time.monotonic()
+        admission.enter_lobby(self.channel_name)
 
         log.info(dumps({
             "event": "player_connected",
@@ -111,10 +197,174 @@ class GameConsumer(WebRTCSignalingConsumer):
             "channels": Active.all()
         }))
 
-        self.accept()
         self.create_group()
 
+    def wait(self):
+        self.group_id = "waiting"
+        position = Waiting.add(self.channel_name)
+
+        log.info(dumps({
+            "event": "player_waiting",
+            "player": self.player.email,
+            "channel": self.channel_name,
+            "position": position
+        }))
+
+        self.send_json({"type": C.WAITING, "data": {"position": position}})
+
+    def admit_waiting(self):
+        """Lets as many waiting players into the lobby as the caps allow"""
+        if not admission.limited:
+            return
+        admitted = Waiting.pop(admission.room(Active.count()))
+        if not admitted:
+            return
+
+        for channel in admitted:
+            try:
+                async_to_sync(self.channel_layer.send)(channel, {"type": C.ADMITTED})
+            except ChannelFull:
+                Waiting.add(channel, front=True)
+
+        for position, channel in enumerate(Waiting.all(), 1):
+            try:
+                async_to_sync(self.channel_layer.send)(channel, {"type": C.WAITING, "data": {"position": position}})
+            except ChannelFull:
+                pass
+
+    @profiled
+    def admitted(self, event):
+        if self.group_id != "waiting":
+            return
+        # The caps of the worker that admitted us may differ from ours
+        if not admission.has_room(Active.count()):
+            Waiting.add(self.channel_name, front=True)
+            return
+
+        self.send_json({"type": C.ADMITTED})
+        self.enter_lobby()
+
+    @profiled
+    def waiting(self, event):
+        if self.group_id == "waiting":
+            self.send_json(event)
+
+    @profiled
+    def worker_drain(self, event):
+        if self.group_id in (None, "lobby", "waiting"):
+            self.handoff(event)
+        else:
+            # Both players move, wherever the other one is connected
+            async_to_sync(self.channel_layer.group_send)(self.group_id, {"type": "group_drain"})
+
+    @profiled
+    def group_drain(self, event):
+        if self.draining:
+            return
+        self.draining = True
+        if self.hosts_game() and self.game is not None and not self.game.actions:
+            self.checkpoint(self.game.game_id, self.seat_scores())
+
+    def hosts_game(self):
+        return self.is_server or self.bot is not None
+
+    def seat_scores(self):
+        """Scores in the order of the game's players"""
+        return list(self.scores) if self.is_server or isinstance(self.game, GroupGame) else self.scores[::-1]
+
+    def checkpoint(self, game_id, scores):
+        """Saves the group's progress for another worker to resume, then sends the players there"""
+        Checkpoint.save(
+            self.group_id,
+            players=self.game.players,
+            info_type=self.game.info_type,
+            session_id=self.game.session_id,
+            game_id=game_id,
+            scores=scores,
+            bot=self.bot,
+            group_game=self.game.game_name if isinstance(self.game, GroupGame) else None
+        )
+        log.info(dumps({"event": "checkpoint", "group": self.group_id, "game_id": game_id}))
+        async_to_sync(self.channel_layer.group_send)(self.group_id, {"type": "handoff"})
+
+    @profiled
+    def handoff(self, event):
+        # A group is drained once, even if both players' workers asked for it
+        if self.handed_off:
+            return
+        self.handed_off = True
+
+        if self.group_id == "lobby":
+            self.add_to_group(self.channel_name, None)
+        elif self.group_id == "waiting":
+            Waiting.delete(self.channel_name)
+        elif self.group_id is not None:
+            chat_buffer.flush(self.group_id)
+            async_to_sync(self.channel_layer.group_discard)(self.group_id, self.channel_name)
+        # Leaving without a group keeps disconnect from ending the session for the other player
+        self.group_id = None
+
+        self.send_json({"type": C.RECONNECT})
+        self.close(code=1012)
+
+    def resume(self, group_id):
+        """Rejoins a group handed off by a draining worker. Returns False if its checkpoint is gone"""
+        # Joined before being recorded, so whoever starts the game reaches this channel
+        async_to_sync(self.channel_layer.group_add)(group_id, self.channel_name)
+        checkpoint = Checkpoint.join(group_id, self.player.email, self.channel_name)
+        if checkpoint is None:
+            async_to_sync(self.channel_layer.group_discard)(group_id, self.channel_name)
+            return False
+
+        players = checkpoint["players"]
+        self.group_id = group_id
+        if checkpoint["group_game"] is None and players[1].email == self.player.email:
+            self.scores = checkpoint["scores"][::-1]
+        else:
+            self.scores = checkpoint["scores"]
+        admission.admit(self.channel_name)
+
+        log.info(dumps({"event": "resumed", "player": self.player.email, "group": group_id}))
+
+        joined = checkpoint["joined"]
+        if any(p.email not in joined for p in players if not p.is_bot):
+            return True
+        if not Checkpoint.claim(group_id, players):
+            return True
+
+        if checkpoint["bot"] is not None:
+            self.bot = checkpoint["bot"]
+            self.bot.player.channel_name = joined[self.bot.player.email] = f"bot.{self.channel_name}"
+        for player in players:
+            player.channel_name = joined[player.email]
+
+        if checkpoint["group_game"] is not None:
+            self.init_group_game(
+                players,
+                group_name=group_id,
+                info_type=checkpoint["info_type"],
+                round_no=checkpoint["game_id"],
+                game_name=checkpoint["group_game"],
+                session_id=checkpoint["session_id"]
+            )
+            return True
+
+        self.init_game(
+            server=players[0],
+            client=players[1],
+            group_name=group_id,
+            info_type=checkpoint["info_type"],
+            game_id=checkpoint["game_id"],
+            session_id=checkpoint["session_id"]
+        )
+        return True
+
+    @profiled
     def disconnect(self, close_code):
+        if self.group_id is None:
+            self.release()
+            return
+
         log.info(dumps({
             "event": C.PLAYER_DISCONNECT,
             "player": self.player.email,
@@ -122,7 +372,11 @@ class GameConsumer(WebRTCSignalingConsumer):
             "channels": Active.all()
         }))
 
-        if self.group_id != "lobby":
+        if self.group_id == "waiting":
+            Waiting.delete(self.channel_name)
+        elif self.group_id != "lobby" and not self.left_group:
+            # Tells the rest of the group once; they leave without telling each other again
+            self.left_group = True
             async_to_sync(self.channel_layer.group_send)(
                 self.group_id, {
                     "type": "player_disconnect",
@@ -132,13 +386,42 @@ class GameConsumer(WebRTCSignalingConsumer):
 
         if self.group_id == "lobby":
             self.add_to_group(self.channel_name, None)
-        else:
+        elif self.group_id != "waiting":
+            chat_buffer.flush(self.group_id)
             async_to_sync(self.channel_layer.group_discard)(self.group_id, self.channel_name)
         super(GameConsumer, self).disconnect(close_code)
+        self.release()
 
+    def release(self):
+        drain.unregister(self.channel_name)
+        if admission.release(self.channel_name):
+            self.admit_waiting()
+
+        if self.profiler is not None:
+            dump_profile(self.profiler, self.channel_name)
+            self.profiler = None
+
+    @classmethod
+    def decode_json(cls, text_data):
+        with timed("serialization"):
+            return super(GameConsumer, cls).decode_json(text_data)
+
+    @classmethod
+    def encode_json(cls, content):
+        with timed("serialization"):
+            return super(GameConsumer, cls).encode_json(content)
+
+    @profiled
+    @traced(root=True)
     def receive_json(self, data, **kwargs):
         data["sender"] = self.channel_name
 
+        # Before logging, so that a flooding client doesn't cost serializing each message
+        bucket = self.buckets.get(message_class(data["type"]))
+        if bucket is not None and not bucket.consume():
+            self.throttle(data["type"], "rate_limited", bucket.retry_after())
+            return
+
         if data['type'] not in C.IGNORE_LOG:
             log.info(dumps({
                 "chanel": self.channel_name,
@@ -146,30 +429,67 @@ class GameConsumer(WebRTCSignalingConsumer):
                 "data": data
             }))
 
+        if self.group_id == "waiting":
+            # Only position queries are answered until the player is admitted
+            if data["type"] == C.RETRY_MATCHING:
+                self.send_json({"type": C.WAITING, "data": {"position": Waiting.position(self.channel_name)}})
+            return
+
         if data["type"] == C.RETRY_MATCHING:
             self.create_group()
 
         elif data["type"] == C.GAME_UPDATE:
-            log.info("HERE" * 10)
-            async_to_sync(self.channel_layer.send)(
-                self.game.server.channel_name,
+            # Games against a bot are run by the consumer hosting the bot
+            self.forward(
+                data["type"],
+                self.channel_layer.send,
+                self.channel_name if self.bot is not None else self.game.server.channel_name,
                 {"type": C.HANDLE_GAME_EVENT, "data": data}
             )
 
+        elif (self.bot is not None or self.opponent is None) and \
+                (data["type"] == C.REMOTE_IMAGE_URI or data["type"] in C.WRTC_COMMANDS):
+            # Media is peer to peer, there is no peer for bots and group games
+            return
+
         elif data["type"] == C.REMOTE_IMAGE_URI:
-            async_to_sync(self.channel_layer.send)(
-                self.opponent.channel_name,
-                data
-            )
+            self.forward(data["type"], self.channel_layer.send, self.opponent.channel_name, data)
 
         elif data["type"] in C.WRTC_COMMANDS:
-            async_to_sync(self.channel_layer.send)(self.opponent.channel_name, data)
+            self.forward(data["type"], self.channel_layer.send, self.opponent.channel_name, data)
 
-        elif data["type"] in COMMANDS_LIST:
-            async_to_sync(self.channel_layer.group_send)(
-                self.group_id, data
-            )
+        elif data["type"] == C.CHAT:
+            if self.forward(data["type"], self.channel_layer.group_send, self.group_id, data):
+                chat_buffer.add(self.group_id, self.player.email, data.get("data"))
 
+        elif data["type"] in COMMANDS_LIST:
+            self.forward(data["type"], self.channel_layer.group_send, self.group_id, data)
+
+    def forward(self, message_type, send, *args):
+        """
+        Sends a client message on, pushing back when this worker's backlog is
+        over WORKER_BACKLOG_LIMIT or the receiving channel is at capacity.
+        Returns whether the message was sent.
+        """
+        if backlog(self.channel_layer) >= settings.WORKER_BACKLOG_LIMIT:
+            self.throttle(message_type, "worker_busy", settings.CHANNEL_FULL_RETRY_AFTER)
+            return False
+        try:
+            async_to_sync(send)(*args[:-1], stamp(args[-1], f"channel_layer.{send.__name__}"))
+            return True
+        except ChannelFull:
+            self.throttle(message_type, "channel_full", settings.CHANNEL_FULL_RETRY_AFTER)
+            return False
+
+    def throttle(self, message_type, reason, retry_after):
+        log.warning(f"Dropped {message_type} from {self.channel_name}: {reason}")
+        self.send_json({
+            "type": C.THROTTLED,
+            "data": {"message_type": message_type, "reason": reason, "retry_after": round(retry_after, 2)}
+        })
+
+    @profiled
+    @traced
     def remote_image_uri(self, event):
         self.send_json(event)
 
@@ -177,30 +497,21 @@ class GameConsumer(WebRTCSignalingConsumer):
         if prev_group_id is not None:
             async_to_sync(self.channel_layer.group_discard)(prev_group_id, channel_name)
         try:
-            async_to_sync(self.channel_layer.group_add)("lobby", channel_name)
+            async_to_sync(self.channel_layer.group_add)(lobby_group(self.channel_layer), channel_name)
         except ConnectionError as e:
             """Connection getting dropped when idle"""
-            async_to_sync(self.channel_layer.group_add)("lobby", channel_name)
+            async_to_sync(self.channel_layer.group_add)(lobby_group(self.channel_layer), channel_name)
 
         Active.set(channel_name, player)
 
     def add_to_group(self, channel_name, group_id):
-        async_to_sync(self.channel_layer.group_discard)("lobby", channel_name)
+        async_to_sync(self.channel_layer.group_discard)(lobby_group(self.channel_layer), channel_name)
         if group_id is not None:
             async_to_sync(self.channel_layer.group_add)(group_id, channel_name)
         Active.delete(channel_name)
+        admission.leave_lobby(channel_name)
 
-    def find_opponent(self) -> List:
-        log.info(dumps(
-            {
-                "group": self.group_id,
-                "self": self.channel_name,
-                "active": Active.all()
-            }
-        ))
-
-        players = Active.all()
-
+    def find_opponent(self, players) -> List[LobbyEntry]:
         for channel in players:
             if channel != self.channel_name:
                 other_player = players[channel]
@@ -216,58 +527,166 @@ class GameConsumer(WebRTCSignalingConsumer):
                 # have_played = False
 
                 if not have_played:
-                    return [self.channel_name, channel]
+                    return [self.lobby_entry, other_player]
+        return None
+
+    def find_players(self, players, size) -> List[LobbyEntry]:
+        """
+        `size` distinct players from the lobby in seat order, starting with this one.
+        Players who finished a session, or played one with someone already seated,
+        are left out, also in dev where the middleware doesn't check eligibility.
+        """
+        group = [self.lobby_entry]
+        emails = {self.player.email}
+        for player in players.values():
+            if player.email in emails or Game.player_has_participated(player.email):
+                continue
+            if not any(Game.players_hava_played(email, player.email) for email in emails):
+                group.append(player)
+                emails.add(player.email)
+                if len(group) == size:
+                    return group
         return None
 
     def create_group(self):
+        # The move into the new group fails if the lobby changed after it was read, then matching starts over
+        matched = None
+        for _ in range(3):
+            lobby = read_lobby(self.channel_layer)
+            players = lobby.players()
 
-        log.info(dumps({
-            "event": C.RETRY_MATCHING,
-            "channels": Active.all(),
-            "self": self.channel_name,
-            "group": self.group_id
-        }))
+            log.info(dumps({
+                "event": C.RETRY_MATCHING,
+                "channels": players,
+                "self": self.channel_name,
+                "group": self.group_id
+            }))
 
-        if self.channel_name not in Active.all():
-            if self.group_id == "lobby":
+            if self.channel_name not in players and self.group_id == "lobby":
                 self.add_to_group(self.channel_name, None)
-                self.add_to_lobby(self.channel_name, self.player, None)
-
-        lobby_channels = self.find_opponent()
+                self.add_to_lobby(self.channel_name, self.lobby_entry, None)
+                lobby = read_lobby(self.channel_layer)
+                players = lobby.players()
 
-        log.info(dumps(
-            {
-                "event": "matched",
-                "player": self.player.email,
-                "channels": lobby_channels
-            }
-        ))
+            matched = self.find_match(players)
 
-        if lobby_channels is not None:
-            group_name = random_str()
+            log.info(dumps(
+                {
+                    "event": "matched",
+                    "player": self.player.email,
+                    "channels": None if matched is None else [p.channel_name for p in matched]
+                }
+            ))
+
+            if matched is None:
+                break
+
+            if self.start_in_group(lobby, self.new_match_game(matched, new_group_name(self.channel_layer))):
+                return
+
+        if matched is None and self.group_id == "lobby" and self.match_other_shards():
+            return
+
+        if matched is None and self.group_id == "lobby" and settings.BOT_MATCH_AFTER is not None \
+                and time.monotonic() - self.lobby_since >= settings.BOT_MATCH_AFTER:
+            self.match_bot()
+
+    def find_match(self, players):
+        if settings.GROUP_SIZE > 2:
+            return self.find_players(players, settings.GROUP_SIZE)
+        return self.find_opponent(players)
+
+    def new_match_game(self, matched, group_name) -> BaseGame:
+        if settings.GROUP_SIZE > 2:
+            return self.new_group_game(matched, group_name)
+        return self.new_game(server=matched[0], client=matched[1], group_name=group_name, game_id=1)
+
+    def match_other_shards(self):
+        """
+        Matches with players in the lobby of another shard, when this one has
+        nobody to match. The group goes on their shard, so only this player's
+        messages cross shards.
+        """
+        own_shard, *other_shards = shards(self.channel_layer)
+        # Only towards higher shards, so that two players can't keep taking each other out of their lobbies
+        for shard in [s for s in other_shards if s > own_shard]:
+            lobby = read_lobby(self.channel_layer, shard)
+            matched = self.find_match(lobby.players())
+            if matched is None:
+                continue
+
+            # Leaving our lobby first keeps anyone else from matching us meanwhile
+            own = read_lobby(self.channel_layer)
+            if self.channel_name not in own.players() or not leave_lobby(self.channel_layer, own, self.channel_name):
+                return False
+
+            game = self.new_match_game(matched, new_group_name(self.channel_layer, shard))
+            with timed("serialization"):
+                message = {"type": C.GAME_START, "data": pickle.dumps(game)}
+            others = [p.channel_name for p in matched if p.channel_name != self.channel_name]
+            if not move_to_group(self.channel_layer, lobby, others, game.group_id, message):
+                self.add_to_lobby(self.channel_name, self.lobby_entry, None)
+                return False
+
+            log.info(dumps({"event": "matched_across_shards", "player": self.player.email, "group": game.group_id}))
+            async_to_sync(self.channel_layer.group_add)(game.group_id, self.channel_name)
+            async_to_sync(self.channel_layer.send)(self.channel_name, message)
+            return True
+        return False
+
+    def start_in_group(self, lobby, game: BaseGame):
+        """Moves the game's players from the lobby into its group and starts it, in one round-trip on Redis"""
+        with timed("serialization"):
+            data = pickle.dumps(game)
+
+        channel_names = [p.channel_name for p in game.players]
+        return move_to_group(self.channel_layer, lobby, channel_names, game.group_id, {"type": C.GAME_START, "data": data})
+
+    def match_bot(self):
+        """Pairs the player with a bot hosted by this consumer, in a random role"""
+        self.bot = Bot.create(settings.BOT_STRATEGY, f"bot.{self.channel_name}")
+        group_name = new_group_name(self.channel_layer)
 
-            server = Active.get(lobby_channels[0])
-            client = Active.get(lobby_channels[1])
+        log.info(dumps({
+            "event": "matched_bot",
+            "player": self.player.email,
+            "strategy": settings.BOT_STRATEGY
+        }))
 
-            self.add_to_group(lobby_channels[0], group_name)
-            self.add_to_group(lobby_channels[1], group_name)
+        self.add_to_group(self.channel_name, group_name)
+        if random.random() >= 0.5:
+            server, client = self.lobby_entry, self.bot.player
+        else:
+            server, client = self.bot.player, self.lobby_entry
 
-            self.init_game(
-                server=server,
-                client=client,
-                group_name=group_name,
-                game_id=1
-            )
+        self.init_game(
+            server=server,
+            client=client,
+            group_name=group_name,
+            info_type=[Game.InfoType.INFO],
+            game_id=1
+        )
+        self.admit_waiting()
 
+    @profiled
     def player_disconnect(self, event):
+        # The group is torn down once per player; the sender also gets its own notice back
+        if self.left_group and event["sender"] != self.channel_name:
+            return
+        self.left_group = True
         async_to_sync(self.channel_layer.group_discard)(self.group_id, self.channel_name)
         self.send_json({"type": C.PLAYER_DISCONNECT})
         self.disconnect(close_code=0)
 
+    @profiled
+    @traced
     def chat(self, event):
         self.send_json(event)
 
-    def init_game(self, server: Player, client: Player, group_name, info_type=None, game_id=1):
+    def init_game(self, server: LobbyEntry, client: LobbyEntry, group_name, info_type=None, game_id=1, session_id=None):
+        self.start_game(self.new_game(server, client, group_name, info_type, game_id, session_id))
+
+    def new_game(self, server: LobbyEntry, client: LobbyEntry, group_name, info_type=None, game_id=1, session_id=None):
         if info_type is None:
             if os.environ["ENV"] == "dev":
                 info_type = [Game.InfoType.INFO, Game.InfoType.CHAT, Game.InfoType.VIDEO]
@@ -288,40 +707,88 @@ class GameConsumer(WebRTCSignalingConsumer):
                         info_type.append(i)
                 info_type = [Game.InfoType.INFO, Game.InfoType.CHAT, Game.InfoType.VIDEO]
 
-        game = get_game(
+        return get_game(
             group_id=group_name,
             server=server,
             client=client,
             info_type=info_type,
-            game_id=game_id
+            game_id=game_id,
+            session_id=session_id
         )
 
+    def init_group_game(self, players: List[LobbyEntry], group_name, info_type=None, round_no=1, game_name=None,
+                        session_id=None):
+        self.start_game(self.new_group_game(players, group_name, info_type, round_no, game_name, session_id))
+
+    def new_group_game(self, players: List[LobbyEntry], group_name, info_type=None, round_no=1, game_name=None,
+                       session_id=None):
+        if info_type is None:
+            # Video and images are peer to peer, so groups get info and chat
+            info_type = [Game.InfoType.INFO, Game.InfoType.CHAT]
+
+        return get_group_game(
+            game_name or settings.GROUP_GAME,
+            group_id=group_name,
+            players=players,
+            info_type=info_type,
+            round_no=round_no,
+            session_id=session_id
+        )
+
+    def start_game(self, game: BaseGame):
+        with timed("serialization"):
+            data = pickle.dumps(game)
+
         async_to_sync(self.channel_layer.group_send)(
-            group_name,
+            game.group_id,
             {
                 "type": C.GAME_START,
-                "data": pickle.dumps(game)
+                "data": data
             }
         )
 
+    @profiled
     def game_start(self, event):
-        game = pickle.loads(event['data'])
+        with timed("serialization"):
+            game = pickle.loads(event['data'])
         self.game = game
         self.group_id = self.game.group_id
-        self.is_server = self.channel_name == self.game.server.channel_name
-
-        if self.is_server:
-            self.opponent = self.game.client
-        else:
-            self.opponent = self.game.server
+        # Players may have been matched by a consumer on another worker, which can't count them out of our lobby
+        if admission.leave_lobby(self.channel_name):
+            self.admit_waiting()
+
+        # Roles and opponent are fixed for the session, so they are only built on its first game
+        if self.session_data is None or self.session_data["group_id"] != self.group_id:
+            self.is_server = self.channel_name == self.game.server.channel_name
+            # The game carries lobby entries, profiles are read once per session for the payload
+            profiles = Player.objects.in_bulk([p.email for p in self.game.players if p.email != self.player.email])
+            profiles[self.player.email] = self.player
+            if isinstance(self.game, GroupGame):
+                self.opponent = None
+                if len(self.scores) != len(self.game.players):
+                    self.scores = [0] * len(self.game.players)
+                with timed("serialization"):
+                    payload = {
+                        "is_server": self.is_server,
+                        "seat": [p.email for p in self.game.players].index(self.player.email),
+                        "players": [profiles[p.email].profile() for p in self.game.players],
+                    }
+            else:
+                self.opponent = self.game.client if self.is_server else self.game.server
+                with timed("serialization"):
+                    payload = {
+                        "is_server": self.is_server,
+                        "opponent": profiles[self.opponent.email].profile(),
+                    }
+            self.session_data = {"group_id": self.group_id, "payload": payload}
 
         message = {
             "type": C.GAME_START,
             "data": {
-                "is_server": self.is_server,
+                **self.session_data["payload"],
+                # Per game, as the outro has none
                 "info_type": self.game.info_type,
                 "game_id": self.game.game_id,
-                "opponent": PlayerSerializer(self.opponent).data,
                 "config": self.game.config,
                 "scores": self.scores
             }
@@ -330,43 +797,102 @@ class GameConsumer(WebRTCSignalingConsumer):
         self.send_json(message)
         log.info(dumps(message))
 
+        if self.draining and self.hosts_game():
+            self.checkpoint(self.game.game_id, self.seat_scores())
+            return
+
+        if self.bot is not None:
+            self.handle_game_event({"data": self.bot.move(self.game)})
+
+    @profiled
+    @traced
     def handle_game_event(self, message: dict):
         data = message['data']
 
+        if not self.game.accepts(data):
+            log.warning(f"Dropped invalid {self.game.game_name} action {data.get('data')!r} from {data['sender']}")
+            return
+
         self.game.update_state(data)
         data["finished"] = self.game.is_complete()
         if data['finished']:
             data['scores'] = self.game.get_current_scores()
 
-        data['sender'] = self.player.email if data['sender'] == self.channel_name else self.opponent.email
+        data['sender'] = self.game.email_of(data['sender'])
 
-        message = {
-            "type": C.GAME_UPDATE,
-            "data": {
-                "last_event": data,
-                "state": self.game.state,
-                "actions": self.game.actions
+        if isinstance(self.game, GroupGame):
+            # Only the new event goes out, so messages don't grow with the group; the state once per round
+            message = {"type": C.GAME_UPDATE, "data": {"last_event": data}}
+            if data['finished']:
+                message["data"]["state"] = self.game.state
+        else:
+            message = {
+                "type": C.GAME_UPDATE,
+                "data": {
+                    "last_event": data,
+                    "state": self.game.state,
+                    "actions": self.game.actions
+                }
             }
-        }
 
         log.info(dumps(message))
 
-        async_to_sync(self.channel_layer.group_send)(self.group_id, message)
+        async_to_sync(self.channel_layer.group_send)(self.group_id, stamp(message, "channel_layer.group_send"))
 
         if self.game.is_complete():
+            if self.bot is not None:
+                self.bot.observe(self.game)
             self.game.save()
+            if isinstance(self.game, GroupGame):
+                self.next_group_round(data["scores"])
+                return
+
+            game_id = (self.game.game_id + 1) % len(GAME_LIST)
+
+            if self.draining and self.game.game_name != "outro":
+                # This round's scores are still on their way to our own game_update
+                scores = [a + b for a, b in zip(self.seat_scores(), data["scores"])]
+                self.checkpoint(game_id, scores)
+                return
+
             self.init_game(
                 server=self.game.server,
                 client=self.game.client,
                 group_name=self.group_id,
-                game_id=(self.game.game_id + 1) % len(GAME_LIST),
-                info_type=self.game.info_type
+                game_id=game_id,
+                info_type=self.game.info_type,
+                session_id=self.game.session_id
             )
             if self.game.game_name == "outro":
                 self.disconnect(123)
 
+    def next_group_round(self, scores):
+        if self.game.is_last_round():
+            self.disconnect(123)
+        elif self.draining:
+            self.checkpoint(self.game.round_no + 1, [a + b for a, b in zip(self.seat_scores(), scores)])
+        else:
+            self.init_group_game(
+                self.game.players,
+                group_name=self.group_id,
+                info_type=self.game.info_type,
+                round_no=self.game.round_no + 1,
+                game_name=self.game.game_name,
+                session_id=self.game.session_id
+            )
+
+    @profiled
+    @traced
     def game_update(self, message):
         data = message["data"]
+
+        if isinstance(self.game, GroupGame):
+            if data['last_event']['finished']:
+                self.game.state = data["state"]
+                self.scores = [a + b for a, b in zip(self.scores, data['last_event']['scores'])]
+            self.send_json(message)
+            return
+
         self.game.state = data["state"]
         self.game.actions = data["actions"]
 
@@ -0,0 +1,126 @@
+import logging
+import signal
+import threading
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+
+log = logging.getLogger(__name__)
+
+# Checkpoints not resumed within this many seconds are dropped
+CHECKPOINT_TTL = 60 * 10
+
+
+class Drain:
+    """
+    Tracks the channels of this worker. Once draining, new connects are
+    refused and every channel is sent a `worker_drain` message so that its
+    consumer can hand the player off to another worker.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.lock = threading.Lock()
+        self.channels = set()
+
+    def register(self, channel_name):
+        with self.lock:
+            self.channels.add(channel_name)
+
+    def unregister(self, channel_name):
+        with self.lock:
+            self.channels.discard(channel_name)
+            done = self.active and not self.channels
+        if done:
+            log.info("Worker drained, safe to stop")
+
+    def start(self):
+        with self.lock:
+            if self.active:
+                return
+            self.active = True
+            channels = list(self.channels)
+
+        log.info(f"Draining {len(channels)} channels")
+        channel_layer = get_channel_layer()
+        for channel in channels:
+            async_to_sync(channel_layer.send)(channel, {"type": "worker_drain"})
+
+
+drain = Drain()
+
+
+def install_signal_handler():
+    """Starts draining on settings.DRAIN_SIGNAL, sent to a worker process (not the gunicorn master)"""
+    if settings.DRAIN_SIGNAL is None:
+        return
+    # The handler runs on the event loop thread, so the sends happen elsewhere
+    signal.signal(
+        getattr(signal, settings.DRAIN_SIGNAL),
+        lambda signum, frame: threading.Thread(target=drain.start, daemon=True).start()
+    )
+
+
+class Checkpoint:
+    """
+    Progress of a group handed off mid-session: players in seat order, game
+    kind, treatment, session, the next game and the scores so far. Players
+    find their group again on reconnect through a per-email pointer, and the
+    session continues once every human player is back.
+    """
+
+    @staticmethod
+    def keys(group_id, players):
+        return [f"checkpoint:{group_id}:started"] + [f"checkpoint:{group_id}:joined:{p.email}" for p in players]
+
+    @staticmethod
+    def save(group_id, players, info_type, session_id, game_id, scores, bot=None, group_game=None):
+        # The group may have been handed off before
+        cache.delete_many(Checkpoint.keys(group_id, players))
+        cache.set(f"checkpoint:{group_id}", {
+            "players": players,
+            "group_game": group_game,
+            "info_type": info_type,
+            "session_id": session_id,
+            "game_id": game_id,
+            "scores": scores,
+            "bot": bot
+        }, CHECKPOINT_TTL)
+        for player in players:
+            if not player.is_bot:
+                cache.set(f"resume:{player.email}", group_id, CHECKPOINT_TTL)
+
+    @staticmethod
+    def for_player(email):
+        return cache.get(f"resume:{email}")
+
+    @staticmethod
+    def join(group_id, email, channel_name):
+        """
+        Records the player's new channel and returns the checkpoint with the
+        channels of the players back so far under "joined", or None if it
+        expired. Players may rejoin at the same time on different workers;
+        each writes its own key before reading the others, so the last one
+        back sees everyone.
+        """
+        cache.set(f"checkpoint:{group_id}:joined:{email}", channel_name, CHECKPOINT_TTL)
+        checkpoint = cache.get(f"checkpoint:{group_id}")
+        if checkpoint is not None:
+            prefix = f"checkpoint:{group_id}:joined:"
+            joined = cache.get_many([prefix + p.email for p in checkpoint["players"]])
+            checkpoint["joined"] = {k[len(prefix):]: v for k, v in joined.items()}
+        return checkpoint
+
+    @staticmethod
+    def claim(group_id, players):
+        """
+        Whether this caller continues the session. Only the first caller
+        does, as several may see every player back. The checkpoint itself
+        is left to expire, for players whose join is still in flight.
+        """
+        if not cache.add(f"checkpoint:{group_id}:started", 1, CHECKPOINT_TTL):
+            return False
+        cache.delete_many([f"resume:{p.email}" for p in players])
+        return True
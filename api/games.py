@@ -1,53 +1,75 @@
+from datetime import datetime
 from typing import List, Type, Dict
 
-from api.models import Player, Game
+from api.models import Session, Round, GroupSession, GroupRound
 
 
 class BaseGame:
     game_name = "base"
     game_id = 0
     config = {}
+    # Actions a player can take and which of them counts as cooperating, for bots and analysis
+    choices = []
+    cooperative = None
 
-    def __init__(self, group_id, server, client, info_type):
+    def __init__(self, group_id, server, client, info_type, session_id=None):
         self.state = {}
         self.actions = []
         self.group_id = group_id
         self.server = server
         self.client = client
         self.info_type = info_type
+        self.session_id = session_id
+        self.started_at = datetime.now()
+        self.players = [server, client]
+        # Emails by channel, to attribute events without scanning the players
+        self.emails = {p.channel_name: p.email for p in self.players}
+
+    def email_of(self, channel_name):
+        return self.emails.get(channel_name, self.client.email)
+
+    def accepts(self, event):
+        """Whether a player's action is valid; invalid ones are dropped"""
+        return True
 
     def update_state(self, event):
         event = event.copy()
-        if event['sender'] == self.server.channel_name:
-            event['sender'] = self.server.email
-        else:
-            event['sender'] = self.client.email
+        event['sender'] = self.email_of(event['sender'])
 
-        actions = list(filter(lambda x: x['sender'] == event['sender'], self.actions))
-
-        if len(actions) > 0:
+        # Only a player's first action counts
+        if event['sender'] in self.state:
             return
 
         self.actions.append(event)
         self.state[event['sender']] = event['data']
 
     def is_complete(self):
-        return len(self.actions) == 2
+        return len(self.state) == len(self.players)
 
     def get_state(self):
         return self.state
 
     def save(self):
-        game = Game(
-            server=self.server,
-            client=self.client,
-            state=self.state,
-            actions=self.actions,
-            info_type=self.info_type,
-            group_id=self.group_id,
-            game_name=self.game_name
+        if self.session_id is None:
+            session = Session.objects.create(
+                group_id=self.group_id,
+                server_id=self.server.email,
+                client_id=self.client.email,
+                info_type=self.info_type,
+                started_at=self.started_at,
+                with_bot=self.server.is_bot or self.client.is_bot
+            )
+            self.session_id = session.session_id
+
+        scores = self.get_current_scores()
+        game_round = Round(
+            session_id=self.session_id,
+            game_name=self.game_name,
+            server_payoff=scores[0],
+            client_payoff=scores[1]
         )
-        game.save()
+        game_round.set_actions(self.state.get(self.server.email), self.state.get(self.client.email))
+        game_round.save()
 
     def get_current_scores(self):
         return [0, 0]
@@ -58,17 +80,19 @@ class Intro(BaseGame):
     game_name = "intro"
     config = {"timeout": 180, "default": ""}
 
-    def __init__(self, group_id, server, client, info_type):
-        super(Intro, self).__init__(group_id, server, client, info_type)
+    def __init__(self, group_id, server, client, info_type, session_id=None):
+        super(Intro, self).__init__(group_id, server, client, info_type, session_id)
 
 
 class Restaurant(BaseGame):
     game_id = 2
     game_name = "restaurant"
     config = {"timeout": 180, "default": "low"}
+    choices = ["high", "low"]
+    cooperative = "high"
 
-    def __init__(self, group_id, server, client, info_type):
-        super(Restaurant, self).__init__(group_id, server, client, info_type)
+    def __init__(self, group_id, server, client, info_type, session_id=None):
+        super(Restaurant, self).__init__(group_id, server, client, info_type, session_id)
 
     def get_current_scores(self):
         ss, cs = 0, 0
@@ -99,9 +123,11 @@ class ATM(BaseGame):
     game_id = 3
     game_name = "atm"
     config = {"timeout": 180, "default": "dont"}
+    choices = ["put", "dont"]
+    cooperative = "put"
 
-    def __init__(self, group_id, server, client, info_type):
-        super(ATM, self).__init__(group_id, server, client, info_type)
+    def __init__(self, group_id, server, client, info_type, session_id=None):
+        super(ATM, self).__init__(group_id, server, client, info_type, session_id)
 
     def get_current_scores(self):
         ss, cs = 0, 0
@@ -128,9 +154,11 @@ class Police(BaseGame):
     game_id = 4
     game_name = "police"
     config = {"timeout": 180, "default": "confess"}
+    choices = ["deny", "confess"]
+    cooperative = "deny"
 
-    def __init__(self, group_id, server, client, info_type):
-        super(Police, self).__init__(group_id, server, client, info_type)
+    def __init__(self, group_id, server, client, info_type, session_id=None):
+        super(Police, self).__init__(group_id, server, client, info_type, session_id)
 
     def get_current_scores(self):
         ss, cs = 0, 0
@@ -161,9 +189,10 @@ class Investment(BaseGame):
     game_name = "investment"
     game_id = 5
     config = {"timeout": 240, "default": 2.5}
+    choices = [0, 1, 2, 3, 4, 5]
 
-    def __init__(self, group_id, server, client, info_type):
-        super(Investment, self).__init__(group_id, server, client, info_type)
+    def __init__(self, group_id, server, client, info_type, session_id=None):
+        super(Investment, self).__init__(group_id, server, client, info_type, session_id)
 
     def get_current_scores(self):
         s_action = self.state[self.server.email]
@@ -180,15 +209,99 @@ class Outro(BaseGame):
     game_name = "outro"
     config = {"timeout": 180, "default": {"trust": 5, "know": False}}
 
-    def __init__(self, group_id, server, client, info_type):
-        super(Outro, self).__init__(group_id, server, client, info_type)
+    def __init__(self, group_id, server, client, info_type, session_id=None):
+        super(Outro, self).__init__(group_id, server, client, info_type, session_id)
         self.info_type = []
 
+    def save(self):
+        super(Outro, self).save()
+        Session.objects.filter(session_id=self.session_id).update(ended_at=datetime.now())
+
+
+class GroupGame(BaseGame):
+    """
+    A game for any number of players, played for `rounds` rounds. `players`
+    are in seat order and the first one hosts the game, like the server of a
+    pair. Scores are lists in seat order.
+    """
+    game_name = "group"
+    rounds = 1
+
+    def __init__(self, group_id, players, info_type, round_no=1, session_id=None):
+        super(GroupGame, self).__init__(group_id, players[0], players[1], info_type, session_id)
+        self.players = players
+        self.emails = {p.channel_name: p.email for p in players}
+        self.round_no = round_no
+        self.game_id = round_no
+
+    def email_of(self, channel_name):
+        return self.emails.get(channel_name)
+
+    def accepts(self, event):
+        return self.email_of(event['sender']) is not None
+
+    def is_last_round(self):
+        return self.round_no >= self.rounds
+
+    def get_current_scores(self):
+        return [0] * len(self.players)
+
+    def save(self):
+        if self.session_id is None:
+            session = GroupSession.objects.create(
+                group_id=self.group_id,
+                game_name=self.game_name,
+                players=[p.email for p in self.players],
+                info_type=self.info_type,
+                started_at=self.started_at
+            )
+            self.session_id = session.session_id
+
+        scores = self.get_current_scores()
+        GroupRound.objects.create(
+            session_id=self.session_id,
+            group_id=self.group_id,
+            game_name=self.game_name,
+            round_no=self.round_no,
+            players=[p.email for p in self.players],
+            info_type=self.info_type,
+            actions=self.state,
+            payoffs={p.email: score for p, score in zip(self.players, scores)}
+        )
+        if self.is_last_round():
+            GroupSession.objects.filter(session_id=self.session_id).update(ended_at=datetime.now())
+
+
+class PublicGoods(GroupGame):
+    game_name = "public_goods"
+    rounds = 5
+    # Players keep what they don't contribute, the pot is multiplied and shared equally
+    config = {"timeout": 180, "default": 0, "endowment": 10, "multiplier": 1.6}
+    choices = list(range(11))
+    cooperative = 10
+
+    def accepts(self, event):
+        contribution = event['data']
+        return super(PublicGoods, self).accepts(event) and isinstance(contribution, (int, float)) \
+            and not isinstance(contribution, bool) and 0 <= contribution <= self.config["endowment"]
+
+    def get_current_scores(self):
+        contributions = [self.state[p.email] for p in self.players]
+        share = self.config["multiplier"] * sum(contributions) / len(self.players)
+        return [self.config["endowment"] - c + share for c in contributions]
+
 
 GAME_LIST: List[Type[BaseGame]] = [BaseGame, Intro, Restaurant, ATM, Police, Investment, Outro]
 
 GAME_MAP: Dict[int, Type[BaseGame]] = {k.game_id: k for k in GAME_LIST}
 
 
-def get_game(group_id, server, client, info_type, game_id) -> BaseGame:
-    return GAME_MAP.get(game_id, BaseGame)(group_id, server, client, info_type)
+def get_game(group_id, server, client, info_type, game_id, session_id=None) -> BaseGame:
+    return GAME_MAP.get(game_id, BaseGame)(group_id, server, client, info_type, session_id)
+
+
+GROUP_GAME_MAP: Dict[str, Type[GroupGame]] = {k.game_name: k for k in [PublicGoods]}
+
+
+def get_group_game(game_name, group_id, players, info_type, round_no=1, session_id=None) -> GroupGame:
+    return GROUP_GAME_MAP[game_name](group_id, players, info_type, round_no, session_id)
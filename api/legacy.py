@@ -0,0 +1,147 @@
+"""
+Conversion of legacy per-round `api_game` rows into Session/Round rows, and
+the read-only `api_game_compat` view that backs the `Game` model. Run by the
+`0002_game_sessions` migration, and by `migrate_game_sessions` to convert a
+legacy table again or recreate the view.
+"""
+import json
+import logging
+
+from django.db import connection, transaction
+
+from api.games import GAME_LIST
+from api.models import Player, Session, Round
+
+log = logging.getLogger(__name__)
+
+GAME_CLASSES = {k.game_name: k for k in GAME_LIST}
+
+
+def action_sql(prefix):
+    return f"""
+        CASE
+            WHEN r.{prefix}_know IS NOT NULL
+                THEN jsonb_build_object('trust', r.{prefix}_amount, 'know', r.{prefix}_know)
+            WHEN r.{prefix}_amount IS NOT NULL THEN to_jsonb(r.{prefix}_amount)
+            ELSE to_jsonb(r.{prefix}_choice)
+        END"""
+
+
+def compat_view_sql(with_bot=True):
+    """The view's definition; without `with_bot` as created before sessions with bots were recorded"""
+    bot_column = ",\n       s.with_bot" if with_bot else ""
+    return f"""
+CREATE OR REPLACE VIEW api_game_compat AS
+SELECT r.round_id AS game_id,
+       r.game_name,
+       CASE WHEN r.game_name = 'outro' THEN ARRAY[]::varchar(10)[] ELSE s.info_type END AS info_type,
+       s.group_id,
+       s.server_id,
+       s.client_id,
+       r.created_at,
+       jsonb_strip_nulls(jsonb_build_object(
+           s.server_id, {action_sql("server")},
+           s.client_id, {action_sql("client")}
+       )) AS state,
+       jsonb_build_array(
+           jsonb_build_object('sender', s.server_id, 'data', {action_sql("server")}),
+           jsonb_build_object('sender', s.client_id, 'data', {action_sql("client")})
+       ) AS actions{bot_column}
+FROM api_round r
+JOIN api_session s ON s.session_id = r.session_id
+"""
+
+
+COMPAT_VIEW_SQL = compat_view_sql()
+
+
+def convert(table="api_game", batch_size=1000, models=(Session, Round)):
+    """
+    Converts the rows of legacy `table` that have no round yet. Rows are
+    streamed from a server-side cursor in session order, `batch_size` at a
+    time, and each session is written as soon as its last row is read, so
+    only one session is held in memory. `models` are the Session and Round
+    classes to write with, historical ones in a migration. Returns the
+    number of sessions and rounds created.
+    """
+    session_count, round_count = 0, 0
+    key, rows = None, []
+
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(
+            f"SELECT game_id, game_name, info_type, group_id, server_id, client_id, created_at, state "
+            f"FROM {connection.ops.quote_name(table)} ORDER BY group_id, server_id, client_id, created_at"
+        )
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            for row in batch:
+                if row[3:6] != key and rows:
+                    created, converted = convert_session(key, rows, batch_size, models)
+                    session_count, round_count = session_count + created, round_count + converted
+                    rows = []
+                key = row[3:6]
+                rows.append(row)
+            if not batch:
+                break
+
+    if rows:
+        created, converted = convert_session(key, rows, batch_size, models)
+        session_count, round_count = session_count + created, round_count + converted
+    return session_count, round_count
+
+
+@transaction.atomic
+def convert_session(key, rows, batch_size, models):
+    """Writes the legacy rows of one (group, server, client) session. Returns sessions and rounds created"""
+    session_model, round_model = models
+    group_id, server_id, client_id = key
+    converted = set(round_model.objects.filter(round_id__in=[r[0] for r in rows]).values_list("round_id", flat=True))
+    rows = [r for r in rows if r[0] not in converted]
+    if not rows:
+        return 0, 0
+
+    created = 0
+    session = session_model.objects.filter(group_id=group_id, server_id=server_id, client_id=client_id).first()
+    if session is None:
+        info_type = next((r[2] for r in rows if r[1] != "outro"), rows[0][2])
+        session = session_model.objects.create(
+            group_id=group_id,
+            server_id=server_id,
+            client_id=client_id,
+            info_type=info_type,
+            started_at=rows[0][6],
+            ended_at=next((r[6] for r in rows if r[1] == "outro"), None)
+        )
+        created = 1
+
+    server, client = Player(email=server_id), Player(email=client_id)
+    objs = []
+    for game_id, game_name, _, _, _, _, created_at, state in rows:
+        if isinstance(state, str):
+            # Django leaves jsonb undecoded on raw cursors
+            state = json.loads(state)
+        game = GAME_CLASSES.get(game_name, GAME_LIST[0])(group_id, server, client, [])
+        game.state = state
+        try:
+            scores = game.get_current_scores()
+        except (KeyError, TypeError) as e:
+            log.warning(f"Could not score {game_name} round {game_id}: {e}")
+            scores = [None, None]
+
+        # What Round.set_actions does, which historical models don't have
+        actions = {}
+        for prefix, email in [("server", server_id), ("client", client_id)]:
+            actions.update(zip([f"{prefix}_choice", f"{prefix}_amount", f"{prefix}_know"],
+                               Round.split_action(state.get(email))))
+        objs.append(round_model(
+            round_id=game_id,
+            session=session,
+            game_name=game_name,
+            created_at=created_at,
+            server_payoff=scores[0],
+            client_payoff=scores[1],
+            **actions
+        ))
+
+    round_model.objects.bulk_create(objs, batch_size=batch_size)
+    return created, len(objs)
@@ -0,0 +1,48 @@
+from .models import Player
+
+
+class LobbyEntry:
+    """
+    What matching and the games need of a player: who they are, where they
+    are connected and the cohort attributes that pick the treatment. Stands
+    in for the Player instance in the lobby cache and in GAME_START, and
+    pickles as a plain tuple. The full profile is read from the database
+    where it is shown.
+    """
+    __slots__ = ("email", "channel_name", "hall", "year", "department", "gender", "is_bot")
+
+    def __init__(self, email, channel_name=None, hall="", year="", department="", gender="M", is_bot=False):
+        self.email = email
+        self.channel_name = channel_name
+        self.hall = hall
+        self.year = year
+        self.department = department
+        self.gender = gender
+        self.is_bot = is_bot
+
+    @staticmethod
+    def of(player: Player, channel_name=None):
+        return LobbyEntry(
+            player.email,
+            channel_name or player.channel_name,
+            player.hall,
+            player.year,
+            player.department,
+            player.gender,
+            player.is_bot
+        )
+
+    def fields(self):
+        return tuple(getattr(self, k) for k in self.__slots__)
+
+    def __reduce__(self):
+        return LobbyEntry, self.fields()
+
+    def __eq__(self, other):
+        return isinstance(other, LobbyEntry) and self.fields() == other.fields()
+
+    def __hash__(self):
+        return hash(self.fields())
+
+    def __repr__(self):
+        return f"LobbyEntry({self.email}, {self.channel_name})"
@@ -0,0 +1,18 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.analysis import analyze
+
+
+class Command(BaseCommand):
+    help = "Cooperation rates, payoff distributions and outro trust metrics over all saved rounds. " \
+           "Results are saved per month to ANALYSIS_STATE_FILE; only months with new rounds are loaded."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true", help="Ignore saved results")
+        parser.add_argument("--chunk-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        results = analyze(rebuild=options["rebuild"], chunk_size=options["chunk_size"])
+        self.stdout.write(json.dumps(results, indent=4))
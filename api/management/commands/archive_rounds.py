@@ -0,0 +1,64 @@
+import gzip
+import os
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.partitioning import TABLE, add_months, list_partitions, month_start, partition_name, partition_start
+
+
+class Command(BaseCommand):
+    help = "Detaches monthly api_round partitions older than the cutoff and archives them as gzipped CSV " \
+           "to BACKUP_DIR, or restores an archive with --restore"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep-months", type=int, default=6, help="Months of rounds to keep attached")
+        parser.add_argument("--restore", metavar="FILE", help="Archive to load back as an attached partition")
+
+    def handle(self, *args, **options):
+        if options["restore"]:
+            self.restore(options["restore"])
+        else:
+            self.archive(add_months(month_start(date.today()), -options["keep_months"]))
+
+    def archive(self, cutoff: date):
+        archive_dir = os.path.join(settings.BACKUP_DIR, "rounds")
+        os.makedirs(archive_dir, exist_ok=True)
+
+        with connection.cursor() as cursor:
+            partitions = list_partitions(cursor)
+
+        for name in partitions:
+            start = partition_start(name)
+            if start is None or start >= cutoff:
+                continue
+
+            path = os.path.join(archive_dir, f"{name}.csv.gz")
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+                with gzip.open(path + ".tmp", "wb") as f:
+                    cursor.copy_expert(f"COPY {name} TO STDOUT WITH CSV HEADER", f)
+                os.replace(path + ".tmp", path)
+                cursor.execute(f"DROP TABLE {name}")
+
+            self.stdout.write(f"Archived {name} to {path}")
+
+    def restore(self, path):
+        name = os.path.basename(path).split(".")[0]
+        start = partition_start(name)
+        if start is None or partition_name(start) != name:
+            raise CommandError(f"{path} is not a round partition archive")
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if name in list_partitions(cursor):
+                raise CommandError(f"{name} is already attached")
+
+            cursor.execute(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS)")
+            with gzip.open(path, "rb") as f:
+                cursor.copy_expert(f"COPY {name} FROM STDIN WITH CSV HEADER", f)
+            cursor.execute(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+                           [start, add_months(start, 1)])
+
+        self.stdout.write(f"Restored {name} from {path}")
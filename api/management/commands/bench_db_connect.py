@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.postgresql import base
+
+from mtp_backend.postgres_pool.base import DatabaseWrapper as PooledDatabaseWrapper
+
+# The queries JwtAuthMiddleware runs on every websocket connect
+CONNECT_QUERIES = [
+    "SELECT * FROM api_player WHERE email = %s",
+    "SELECT 1 FROM api_session WHERE (server_id = %s OR client_id = %s) AND ended_at IS NOT NULL "
+    "AND NOT with_bot LIMIT 1",
+]
+
+
+class Command(BaseCommand):
+    help = "Measures database time per websocket connect with and without the connection pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--connects", type=int, default=200)
+        parser.add_argument("--email", default="nobody@example.com")
+
+    def handle(self, *args, **options):
+        settings_dict = {**connections["default"].settings_dict}
+        for name, wrapper_class in [("unpooled", base.DatabaseWrapper), ("pooled", PooledDatabaseWrapper)]:
+            latencies = sorted(self.run(wrapper_class, settings_dict, options["connects"], options["email"]))
+            self.stdout.write(f"{name}: mean {sum(latencies) / len(latencies) * 1000:.2f}ms, "
+                              f"p50 {latencies[len(latencies) // 2] * 1000:.2f}ms, "
+                              f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.2f}ms")
+
+    @staticmethod
+    def run(wrapper_class, settings_dict, connects, email):
+        latencies = []
+        for _ in range(connects):
+            start = time.perf_counter()
+            # A fresh wrapper per connect, like a connection closed after every consumer call
+            connection = wrapper_class(settings_dict, alias="bench")
+            with connection.cursor() as cursor:
+                cursor.execute(CONNECT_QUERIES[0], [email])
+                cursor.execute(CONNECT_QUERIES[1], [email, email])
+            connection.close()
+            latencies.append(time.perf_counter() - start)
+        return latencies
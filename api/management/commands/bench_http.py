@@ -0,0 +1,38 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Fires concurrent requests at a running server to compare throughput of the sync and " \
+           "async (ASYNC_VIEWS=1) player endpoints"
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", help="e.g. http://localhost:8000/player/check/")
+        parser.add_argument("--token", default="", help="Google ID token sent as bearer token")
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=50)
+
+    def handle(self, *args, **options):
+        session = requests.Session()
+        headers = {"Authorization": f"Bearer {options['token']}"}
+
+        def fetch(_):
+            start = time.perf_counter()
+            response = session.get(options["url"], headers=headers)
+            return time.perf_counter() - start, response.status_code
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            results = list(executor.map(fetch, range(options["requests"])))
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(r[0] for r in results)
+        errors = sum(1 for r in results if r[1] >= 400)
+        self.stdout.write(f"{len(results)} requests in {elapsed:.2f}s: {len(results) / elapsed:.1f} req/s, "
+                          f"{errors} errors")
+        self.stdout.write(f"p50 {statistics.median(latencies) * 1000:.1f}ms, "
+                          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms")
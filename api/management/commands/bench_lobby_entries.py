@@ -0,0 +1,59 @@
+import pickle
+import tracemalloc
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from api.games import get_game
+from api.lobby import LobbyEntry
+from api.models import Player
+
+
+class Command(BaseCommand):
+    help = "Compares lobby entries as pickled Player instances and as LobbyEntry records: " \
+           "bytes per entry in the lobby cache, memory per entry once loaded and GAME_START size"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--entries", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = options["entries"]
+        players = [self.player(i) for i in range(count)]
+
+        for name, entry in [("Player", lambda p: p), ("LobbyEntry", LobbyEntry.of)]:
+            lobby = self.lobby([entry(p) for p in players])
+            raw = pickle.dumps(lobby, pickle.HIGHEST_PROTOCOL)
+
+            tracemalloc.start()
+            loaded = pickle.loads(raw)
+            memory, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del loaded
+
+            game = get_game("bench", entry(players[0]), entry(players[1]), [], game_id=1)
+            self.stdout.write(f"{name}: {len(raw) / count:.0f} bytes per entry in the cache, "
+                              f"{memory / count:.0f} bytes per entry loaded, "
+                              f"{len(pickle.dumps(game))} bytes per GAME_START")
+
+    @staticmethod
+    def player(i):
+        # Players as loaded for a connection, with the profile fields filled in
+        player = Player.from_db("default", [f.attname for f in Player._meta.concrete_fields], [
+            f"student{i}@kgpian.iitkgp.ac.in",
+            f"Student Number {i}",
+            f"https://lh3.googleusercontent.com/a/avatar-{i:08d}=s96-c",
+            "Lal Bahadur Shastri Hall",
+            "3",
+            "Computer Science and Engineering",
+            f"19CS{i:05d}",
+            f"student{i}@okaxis",
+            "M",
+            False
+        ])
+        player.channel_name = f"specific.a1b2c3d4!{i:012d}"
+        return player
+
+    @staticmethod
+    def lobby(entries):
+        ttl = int(datetime.now().timestamp()) + 60 * 15
+        return {e.channel_name: {"data": e, "ttl": ttl} for e in entries}
@@ -0,0 +1,113 @@
+import inspect
+import pickle
+import time
+from contextlib import contextmanager
+
+import redis.asyncio.client
+import redis.client
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand, CommandError
+
+from api.consumers import Active, C
+from api.games import get_game
+from api.lobby import LobbyEntry
+from api.transitions import pipelined, read_lobby, move_to_group, lobby_group, new_group_name
+
+
+@contextmanager
+def count_round_trips(counter):
+    """Counts commands sent to Redis by the cache and the channel layer, a pipeline counting once"""
+    patched = [
+        (redis.client.Redis, "execute_command"),
+        (redis.client.Pipeline, "execute"),
+        (redis.asyncio.client.Redis, "execute_command"),
+        (redis.asyncio.client.Pipeline, "execute"),
+    ]
+    originals = [(cls, name, getattr(cls, name)) for cls, name in patched]
+
+    def wrap(original):
+        if inspect.iscoroutinefunction(original):
+            async def counted(*args, **kwargs):
+                counter[0] += 1
+                return await original(*args, **kwargs)
+        else:
+            def counted(*args, **kwargs):
+                counter[0] += 1
+                return original(*args, **kwargs)
+        return counted
+
+    for cls, name, original in originals:
+        setattr(cls, name, wrap(original))
+    try:
+        yield
+    finally:
+        for cls, name, original in originals:
+            setattr(cls, name, original)
+
+
+class Command(BaseCommand):
+    help = "Counts Redis round-trips and time per lobby match, step by step as before and as one scripted " \
+           "transition. Adds synthetic players to the lobby, so run it against a Redis without live players"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--matches", type=int, default=200)
+
+    def handle(self, *args, **options):
+        channel_layer = get_channel_layer()
+        if not pipelined(channel_layer):
+            raise CommandError("Needs the Redis channel layer and cache on the same server, or REDIS_SHARDS")
+
+        for name, match in [("step by step", self.match_step_by_step), ("scripted", self.match_scripted)]:
+            counter = [0]
+            elapsed = 0
+            for i in range(options["matches"]):
+                server, client = self.lobby_pair(channel_layer, i)
+                with count_round_trips(counter):
+                    start = time.perf_counter()
+                    match(channel_layer, server, client)
+                    elapsed += time.perf_counter() - start
+            self.stdout.write(f"{name}: {counter[0] / options['matches']:.1f} round-trips, "
+                              f"{elapsed / options['matches'] * 1000:.2f}ms per match")
+
+    @staticmethod
+    def lobby_pair(channel_layer, i):
+        # Channels of this process share one message key, so earlier GAME_STARTs would fill it
+        async def clear():
+            name = channel_layer.non_local_name(await channel_layer.new_channel())
+            await channel_layer.connection(channel_layer.consistent_hash(name)).delete(channel_layer.prefix + name)
+        async_to_sync(clear)()
+
+        players = []
+        for seat in ("server", "client"):
+            player = LobbyEntry(f"{seat}-{i}@bench.mtp", async_to_sync(channel_layer.new_channel)())
+            async_to_sync(channel_layer.group_add)(lobby_group(channel_layer), player.channel_name)
+            Active.set(player.channel_name, player)
+            players.append(player)
+        return players
+
+    @staticmethod
+    def match_step_by_step(channel_layer, server, client):
+        """The calls create_group made for a match before transitions were scripted"""
+        Active.all()
+        Active.all()
+        Active.all()
+        Active.all()
+        server, client = Active.get(server.channel_name), Active.get(client.channel_name)
+        group_name = new_group_name(channel_layer)
+        for channel_name in (server.channel_name, client.channel_name):
+            async_to_sync(channel_layer.group_discard)(lobby_group(channel_layer), channel_name)
+            async_to_sync(channel_layer.group_add)(group_name, channel_name)
+            Active.delete(channel_name)
+        game = get_game(group_name, server, client, [], game_id=1)
+        async_to_sync(channel_layer.group_send)(group_name, {"type": C.GAME_START, "data": pickle.dumps(game)})
+
+    @staticmethod
+    def match_scripted(channel_layer, server, client):
+        lobby = read_lobby(channel_layer)
+        players = lobby.players()
+        server, client = players[server.channel_name], players[client.channel_name]
+        game = get_game(new_group_name(channel_layer), server, client, [], game_id=1)
+        message = {"type": C.GAME_START, "data": pickle.dumps(game)}
+        if not move_to_group(channel_layer, lobby, [server.channel_name, client.channel_name], game.group_id, message):
+            raise CommandError("Lobby changed during the benchmark, is a server using this Redis?")
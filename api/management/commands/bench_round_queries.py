@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api.models import Player, Session, Round
+
+GAME_NAMES = ["intro", "restaurant", "atm", "police", "investment", "outro"]
+
+SYNTHETIC_ROUNDS_SQL = """
+INSERT INTO api_round (round_id, session_id, game_name, created_at, server_choice, client_choice)
+SELECT md5(random()::text || i::text)::uuid,
+       %s,
+       (%s::text[])[1 + i %% 6],
+       now() - (i || ' seconds')::interval,
+       (ARRAY['high', 'low'])[1 + floor(random() * 2)::int],
+       (ARRAY['high', 'low'])[1 + floor(random() * 2)::int]
+FROM generate_series(1, %s) AS i
+"""
+
+
+class Command(BaseCommand):
+    help = "Times action queries on a synthetic Round table with and without the choice indexes. " \
+           "Everything runs in a transaction that is rolled back."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            server = Player.objects.create(email="bench-server@example.com", name="bench")
+            client = Player.objects.create(email="bench-client@example.com", name="bench")
+            session = Session.objects.create(group_id="bench", server=server, client=client)
+
+            with connection.cursor() as cursor:
+                start = time.perf_counter()
+                cursor.execute(SYNTHETIC_ROUNDS_SQL, [session.session_id, GAME_NAMES, options["rows"]])
+                cursor.execute("ANALYZE api_round")
+                self.stdout.write(f"Inserted {options['rows']} rounds in {time.perf_counter() - start:.2f}s")
+
+                query = Round.objects.with_actions("restaurant", both="high")
+                indexed = self.time_query(query, options["repeat"])
+
+                cursor.execute("SET LOCAL enable_indexscan = off")
+                cursor.execute("SET LOCAL enable_bitmapscan = off")
+                cursor.execute("SET LOCAL enable_indexonlyscan = off")
+                scanned = self.time_query(query, options["repeat"])
+
+            self.stdout.write(f"restaurant/both=high, sequential scan: {scanned * 1000:.1f}ms")
+            self.stdout.write(f"restaurant/both=high, indexed:         {indexed * 1000:.1f}ms")
+            self.stdout.write(f"Speedup: {scanned / indexed:.1f}x")
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def time_query(query, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            query.count()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
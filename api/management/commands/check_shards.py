@@ -0,0 +1,53 @@
+import time
+from collections import Counter
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels_redis.utils import _consistent_hash
+from django.core.management.base import BaseCommand, CommandError
+
+from api.sharding import HashRing
+from api.transitions import read_lobby, sharded
+from api.utils import random_str
+
+
+class Command(BaseCommand):
+    help = "Pings each Redis shard of the channel layer, shows its lobby and how evenly groups are placed, " \
+           "and how many groups would move if the last shard was removed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--groups", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        channel_layer = get_channel_layer()
+        if not sharded(channel_layer):
+            raise CommandError("The channel layer is not sharded, set REDIS_SHARDS to several servers")
+
+        for shard in range(channel_layer.ring_size):
+            async def ping():
+                start = time.perf_counter()
+                await channel_layer.connection(shard).ping()
+                return time.perf_counter() - start
+
+            self.stdout.write(f"Shard {shard} ({channel_layer.label(shard)}): "
+                              f"{async_to_sync(ping)() * 1000:.1f}ms ping, "
+                              f"{len(read_lobby(channel_layer, shard).players())} players in lobby "
+                              f"{channel_layer.lobby_groups[shard]}")
+        self.stdout.write(f"This process is on shard {channel_layer.shard}")
+
+        names = [random_str() for _ in range(options["groups"])]
+        placed = Counter(channel_layer.consistent_hash(name) for name in names)
+        self.stdout.write("Groups per shard: " + ", ".join(
+            f"{shard}: {placed[shard] / len(names):.1%}" for shard in range(channel_layer.ring_size)
+        ))
+
+        if channel_layer.ring_size > 2:
+            labels = [channel_layer.label(i) for i in range(channel_layer.ring_size)]
+            smaller = HashRing(labels[:-1])
+            ring_moved = sum(channel_layer.ring.node(n) != smaller.node(n) for n in names if
+                             channel_layer.ring.node(n) != labels[-1])
+            modulo_moved = sum(_consistent_hash(n, len(labels)) != _consistent_hash(n, len(labels) - 1)
+                               for n in names if _consistent_hash(n, len(labels)) != len(labels) - 1)
+            self.stdout.write(f"Groups not on the last shard that move when it is removed: "
+                              f"{ring_moved / len(names):.1%} with the hash ring, "
+                              f"{modulo_moved / len(names):.1%} with channels_redis' placement")
@@ -0,0 +1,58 @@
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+class Command(BaseCommand):
+    help = "Reports what importing the ASGI entry point costs, per module and per package, in a fresh " \
+           "interpreter (python -X importtime). Fails if the total is over --budget-ms"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--module", default="mtp_backend.asgi")
+        parser.add_argument("--budget-ms", type=float, help="Fail if importing the module takes longer")
+        parser.add_argument("--top", type=int, default=20, help="Modules and packages to list")
+        parser.add_argument("--repeat", type=int, default=3, help="Runs to take the fastest of")
+
+    def handle(self, *args, **options):
+        runs = [self.measure(options["module"]) for _ in range(options["repeat"])]
+        modules = min(runs, key=lambda r: sum(m[0] for m in r.values()))
+        total = sum(m[0] for m in modules.values()) / 1000
+
+        packages = defaultdict(float)
+        for name, (own, _) in modules.items():
+            packages[name.split(".")[0]] += own / 1000
+
+        self.stdout.write("Slowest packages (own time of their modules):")
+        for name, ms in sorted(packages.items(), key=lambda p: -p[1])[:options["top"]]:
+            self.stdout.write(f"  {ms:8.1f}ms  {name}")
+
+        self.stdout.write("Slowest modules (including what they import):")
+        for name, (_, cumulative) in sorted(modules.items(), key=lambda m: -m[1][1])[:options["top"]]:
+            self.stdout.write(f"  {cumulative / 1000:8.1f}ms  {name}")
+
+        self.stdout.write(f"Importing {options['module']}: {total:.1f}ms, {len(modules)} modules")
+        if options["budget_ms"] is not None and total > options["budget_ms"]:
+            raise CommandError(f"Over the import budget of {options['budget_ms']:.0f}ms")
+
+    @staticmethod
+    def measure(module):
+        """Own and cumulative import time in microseconds of each module imported with `module`"""
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True, text=True, env=os.environ.copy()
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+        modules = {}
+        for line in result.stderr.splitlines():
+            match = LINE.match(line)
+            if match:
+                modules[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+        return modules
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DataError
+
+from api.provisioning import import_players, COLUMNS
+
+
+class Command(BaseCommand):
+    help = "Creates or updates pre-registered players from a CSV file with a header row, " \
+           f"in one COPY, one insert and one update. Columns: {', '.join(COLUMNS)} (email required)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="CSV file to import")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            with open(options["file"], "rb") as f:
+                created, updated = import_players(f)
+        except (OSError, ValueError, DataError) as e:
+            raise CommandError(e)
+
+        self.stdout.write(f"Created {created} and updated {updated} players "
+                          f"in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.legacy import COMPAT_VIEW_SQL, convert
+
+
+class Command(BaseCommand):
+    help = "Converts legacy per-round `api_game` rows into Session/Round rows and (re)creates the " \
+           "read-only `api_game_compat` view backing the `Game` model. `migrate` does both once; " \
+           "this converts rows written to the legacy table since"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--table", default="api_game", help="Legacy table to convert")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows read and written per query")
+        parser.add_argument("--view-only", action="store_true", help="Only (re)create the compat view")
+
+    def handle(self, *args, **options):
+        if not options["view_only"]:
+            sessions, rounds = convert(options["table"], options["batch_size"])
+            self.stdout.write(f"Converted {rounds} rounds into {sessions} sessions")
+
+        with connection.cursor() as cursor:
+            cursor.execute(COMPAT_VIEW_SQL)
+        self.stdout.write("Created view api_game_compat")
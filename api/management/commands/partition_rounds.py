@@ -0,0 +1,27 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api.partitioning import TABLE, add_months, create_partition, is_partitioned, list_partitions, month_start, \
+    rebuild
+
+
+class Command(BaseCommand):
+    help = "Creates monthly api_round partitions ahead of time, e.g. from a monthly cron. The table is " \
+           "partitioned by the 0004_partition_rounds migration, or here if it is not yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ahead", type=int, default=3, help="Months of partitions to create ahead")
+
+    def handle(self, *args, **options):
+        with transaction.atomic(), connection.cursor() as cursor:
+            if not is_partitioned(cursor):
+                rebuild(cursor, partitioned=True)
+                self.stdout.write(f"Partitioned {TABLE} by created_at")
+
+            start = month_start(date.today())
+            for i in range(options["ahead"] + 1):
+                create_partition(cursor, add_months(start, i))
+
+            self.stdout.write(f"Partitions: {', '.join(list_partitions(cursor))}")
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.bots import Bot, STRATEGIES
+from api.games import GAME_LIST, get_game
+from api.models import Game
+from api.utils import random_str
+
+
+class Command(BaseCommand):
+    help = "Plays synthetic bot-vs-bot sessions through the game classes and saves them like live ones, " \
+           "for load tests and analysis dry runs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sessions", type=int, default=1000)
+        parser.add_argument("--server-strategy", choices=STRATEGIES.keys(), default="random")
+        parser.add_argument("--client-strategy", choices=STRATEGIES.keys(), default="random")
+        parser.add_argument("--batch-size", type=int, default=100, help="Sessions per transaction")
+        parser.add_argument("--dry-run", action="store_true", help="Play without saving")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        remaining = options["sessions"]
+        while remaining > 0:
+            batch = min(remaining, options["batch_size"])
+            with transaction.atomic():
+                for _ in range(batch):
+                    self.play(options["server_strategy"], options["client_strategy"], not options["dry_run"])
+            remaining -= batch
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"Played {options['sessions']} sessions in {elapsed:.2f}s "
+                          f"({options['sessions'] / elapsed:.1f} sessions/s)")
+
+    @staticmethod
+    def play(server_strategy, client_strategy, save):
+        group_id = random_str()
+        server = Bot.create(server_strategy, f"bot.{group_id}.server", seat=0)
+        client = Bot.create(client_strategy, f"bot.{group_id}.client", seat=1)
+        info_type = [Game.InfoType.INFO, Game.InfoType.CHAT, Game.InfoType.VIDEO]
+
+        session_id = None
+        for game_class in GAME_LIST[1:]:
+            game = get_game(group_id, server.player, client.player, info_type, game_class.game_id, session_id)
+            game.update_state(server.move(game))
+            game.update_state(client.move(game))
+            server.observe(game)
+            client.observe(game)
+            if save:
+                game.save()
+                session_id = game.session_id
@@ -1,10 +1,8 @@
 import logging
 import os
 
-from channels.auth import AuthMiddlewareStack
 from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
-from django.db import close_old_connections
 
 from api.models import Player, Game
 from api.utils import get_user_info
@@ -15,8 +13,7 @@ class JwtAuthMiddleware(BaseMiddleware):
         self.inner = inner
 
     async def __call__(self, scope, receive, send):
-        close_old_connections()
-
+        # database_sync_to_async closes (returns to the pool) connections around each call
         token = str(scope["query_string"]).split("=")[1] + "=="
         user_info = get_user_info(token)
 
@@ -42,4 +39,6 @@ class JwtAuthMiddleware(BaseMiddleware):
 
 
 def JwtAuthMiddlewareStack(inner):
+    # Loads sessions and contrib.auth, which the slim stack (ASGI_SLIM) does without
+    from channels.auth import AuthMiddlewareStack
     return JwtAuthMiddleware(AuthMiddlewareStack(inner))
@@ -0,0 +1,77 @@
+import datetime
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+from api.legacy import compat_view_sql, convert
+
+
+DROP_LEGACY_FKS_SQL = """
+DO $$
+DECLARE fk record;
+BEGIN
+    FOR fk IN SELECT conname FROM pg_constraint WHERE conrelid = 'api_game'::regclass AND contype = 'f' LOOP
+        EXECUTE format('ALTER TABLE api_game DROP CONSTRAINT %I', fk.conname);
+    END LOOP;
+END $$
+"""
+
+ADD_LEGACY_FKS_SQL = """
+ALTER TABLE api_game
+    ADD FOREIGN KEY (server_id) REFERENCES api_player (email) DEFERRABLE INITIALLY DEFERRED,
+    ADD FOREIGN KEY (client_id) REFERENCES api_player (email) DEFERRABLE INITIALLY DEFERRED
+"""
+
+
+def convert_legacy_games(apps, schema_editor):
+    convert("api_game", models=(apps.get_model("api", "Session"), apps.get_model("api", "Round")))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Session',
+            fields=[
+                ('session_id', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('group_id', models.CharField(db_index=True, max_length=100)),
+                ('info_type', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=10), default=list, size=None)),
+                ('started_at', models.DateTimeField(default=datetime.datetime.now)),
+                ('ended_at', models.DateTimeField(null=True)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='client_sessions', to='api.player')),
+                ('server', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='server_sessions', to='api.player')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Round',
+            fields=[
+                ('round_id', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('game_name', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(default=datetime.datetime.now)),
+                ('server_choice', models.TextField(null=True)),
+                ('server_amount', models.FloatField(null=True)),
+                ('server_know', models.BooleanField(null=True)),
+                ('server_payoff', models.FloatField(null=True)),
+                ('client_choice', models.TextField(null=True)),
+                ('client_amount', models.FloatField(null=True)),
+                ('client_know', models.BooleanField(null=True)),
+                ('client_payoff', models.FloatField(null=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rounds', to='api.session')),
+            ],
+        ),
+        migrations.RunPython(convert_legacy_games, migrations.RunPython.noop),
+        migrations.RunSQL(compat_view_sql(with_bot=False), "DROP VIEW IF EXISTS api_game_compat"),
+        # The legacy table stays for `migrate_game_sessions`, Game reads the view from now on. Unmanaged,
+        # its foreign keys would keep players from being deleted and tables from being flushed.
+        migrations.SeparateDatabaseAndState(database_operations=[
+            migrations.RunSQL(DROP_LEGACY_FKS_SQL, ADD_LEGACY_FKS_SQL),
+        ], state_operations=[
+            migrations.AlterModelOptions(name='game', options={'managed': False}),
+            migrations.AlterModelTable(name='game', table='api_game_compat'),
+        ]),
+    ]
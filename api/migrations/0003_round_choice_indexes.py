@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_game_sessions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='round',
+            index=models.Index(fields=['game_name', 'server_choice', 'client_choice'], name='round_choices_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='round',
+            index=models.Index(fields=['game_name', 'client_choice'], name='round_client_choice_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+from api.partitioning import rebuild
+
+
+def partition(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        rebuild(cursor, partitioned=True)
+
+
+def unpartition(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        rebuild(cursor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+    """
+    Range-partitions api_round by month of created_at. The primary key becomes
+    (round_id, created_at) in the database only, see api/partitioning.py.
+    """
+
+    dependencies = [
+        ('api', '0003_round_choice_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
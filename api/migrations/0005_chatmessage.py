@@ -0,0 +1,23 @@
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_partition_rounds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatMessage',
+            fields=[
+                ('message_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('group_id', models.CharField(db_index=True, max_length=100)),
+                ('message', models.JSONField(null=True)),
+                ('sent_at', models.DateTimeField(default=datetime.datetime.now)),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_messages', to='api.player')),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+
+from api.legacy import compat_view_sql
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_chatmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='is_bot',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='with_bot',
+            field=models.BooleanField(default=False),
+        ),
+        # Only state for the unmanaged Game, the view gets the column below
+        migrations.AddField(
+            model_name='game',
+            name='with_bot',
+            field=models.BooleanField(default=False),
+        ),
+        # A view can't lose columns with CREATE OR REPLACE, so going back recreates it
+        migrations.RunSQL(
+            compat_view_sql(),
+            "DROP VIEW api_game_compat; " + compat_view_sql(with_bot=False)
+        ),
+    ]
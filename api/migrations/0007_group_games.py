@@ -0,0 +1,42 @@
+import datetime
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_bots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupSession',
+            fields=[
+                ('session_id', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('group_id', models.CharField(db_index=True, max_length=100)),
+                ('game_name', models.CharField(max_length=100)),
+                ('players', django.contrib.postgres.fields.ArrayField(base_field=models.EmailField(max_length=254), default=list, size=None)),
+                ('info_type', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=10), default=list, size=None)),
+                ('started_at', models.DateTimeField(default=datetime.datetime.now)),
+                ('ended_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GroupRound',
+            fields=[
+                ('round_id', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('group_id', models.CharField(db_index=True, max_length=100)),
+                ('game_name', models.CharField(max_length=100)),
+                ('round_no', models.IntegerField()),
+                ('players', django.contrib.postgres.fields.ArrayField(base_field=models.EmailField(max_length=254), default=list, size=None)),
+                ('info_type', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=10), default=list, size=None)),
+                ('actions', models.JSONField(default=dict)),
+                ('payoffs', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(default=datetime.datetime.now)),
+                ('session', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rounds', to='api.groupsession')),
+            ],
+        ),
+    ]
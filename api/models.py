@@ -16,8 +16,16 @@ class Player(models.Model):
     roll_no = models.CharField(name="roll_no", max_length=100, default="")
     upi_id = models.CharField(name="upi_id", max_length=100, null=True)
     gender = models.CharField(name="gender", max_length=100, null=True, default="M")
+    is_bot = models.BooleanField(name="is_bot", default=False)
     channel_name = None
 
+    # What other players see, as serialized by PlayerSerializer
+    PROFILE_FIELDS = ['name', 'email', 'avatar', 'hall', 'year', 'department', 'upi_id', 'gender', 'roll_no']
+
+    def profile(self) -> dict:
+        """Same output as PlayerSerializer, without loading DRF on the websocket path"""
+        return {field: getattr(self, field) for field in Player.PROFILE_FIELDS}
+
     @staticmethod
     def get_if_exists(email):
         objs = Player.objects.filter(email=email)
@@ -27,7 +35,119 @@ class Player(models.Model):
             return None
 
 
+class Session(models.Model):
+    session_id = models.UUIDField(name="session_id", primary_key=True, default=uuid.uuid4)
+    group_id = models.CharField(name="group_id", max_length=100, db_index=True)
+    server = models.ForeignKey(name="server", related_name="server_sessions", to=Player, on_delete=models.CASCADE)
+    client = models.ForeignKey(name="client", related_name="client_sessions", to=Player, on_delete=models.CASCADE)
+    info_type = ArrayField(models.CharField(max_length=10), default=list)
+
+    started_at = models.DateTimeField(name="started_at", default=datetime.now)
+    ended_at = models.DateTimeField(name="ended_at", null=True)
+    with_bot = models.BooleanField(name="with_bot", default=False)
+
+    @staticmethod
+    def completed_by(email):
+        """Sessions the player finished against another player; sessions with a bot don't count"""
+        return Session.objects.filter(
+            models.Q(server_id=email) | models.Q(client_id=email),
+            ended_at__isnull=False,
+            with_bot=False
+        )
+
+
+class RoundQuerySet(models.QuerySet):
+    def with_actions(self, game_name, server=None, client=None, both=None):
+        """
+        Rounds of `game_name` filtered on the players' choices, e.g.
+        `with_actions("restaurant", both="high")`. Served by the choice indexes.
+        """
+        if both is not None:
+            server = client = both
+        qs = self.filter(game_name=game_name)
+        if server is not None:
+            qs = qs.filter(server_choice=server)
+        if client is not None:
+            qs = qs.filter(client_choice=client)
+        return qs
+
+
+class Round(models.Model):
+    """
+    One played game of a session. Player actions are stored in typed columns:
+    discrete choices in `*_choice`, numeric amounts (investment, outro trust) in
+    `*_amount` and the outro "know" answer in `*_know`.
+    """
+    round_id = models.UUIDField(name="round_id", primary_key=True, default=uuid.uuid4)
+    session = models.ForeignKey(name="session", related_name="rounds", to=Session, on_delete=models.CASCADE)
+    game_name = models.CharField(name="game_name", max_length=100)
+    created_at = models.DateTimeField(name="created_at", default=datetime.now)
+
+    server_choice = models.TextField(name="server_choice", null=True)
+    server_amount = models.FloatField(name="server_amount", null=True)
+    server_know = models.BooleanField(name="server_know", null=True)
+    server_payoff = models.FloatField(name="server_payoff", null=True)
+
+    client_choice = models.TextField(name="client_choice", null=True)
+    client_amount = models.FloatField(name="client_amount", null=True)
+    client_know = models.BooleanField(name="client_know", null=True)
+    client_payoff = models.FloatField(name="client_payoff", null=True)
+
+    objects = RoundQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["game_name", "server_choice", "client_choice"], name="round_choices_idx"),
+            models.Index(fields=["game_name", "client_choice"], name="round_client_choice_idx"),
+        ]
+
+    @staticmethod
+    def split_action(action):
+        """Maps a raw action from the game state to (choice, amount, know)"""
+        if isinstance(action, dict):
+            return None, action.get('trust'), bool(action.get('know', False))
+        if isinstance(action, (int, float)) and not isinstance(action, bool):
+            return None, float(action), None
+        if action is None:
+            return None, None, None
+        return str(action), None, None
+
+    @staticmethod
+    def join_action(choice, amount, know):
+        """Inverse of `split_action`"""
+        if know is not None:
+            return {"trust": amount, "know": know}
+        if amount is not None:
+            return amount
+        return choice
+
+    def set_actions(self, server_action, client_action):
+        self.server_choice, self.server_amount, self.server_know = Round.split_action(server_action)
+        self.client_choice, self.client_amount, self.client_know = Round.split_action(client_action)
+
+    @property
+    def server_action(self):
+        return Round.join_action(self.server_choice, self.server_amount, self.server_know)
+
+    @property
+    def client_action(self):
+        return Round.join_action(self.client_choice, self.client_amount, self.client_know)
+
+
+class GameQuerySet(models.QuerySet):
+    def with_actions(self, game_name, server=None, client=None, both=None):
+        """Legacy-shaped rows for `Round.objects.with_actions`, avoiding a scan over the JSON state"""
+        rounds = Round.objects.with_actions(game_name, server=server, client=client, both=both)
+        return self.filter(game_id__in=rounds.values("round_id"))
+
+
 class Game(models.Model):
+    """
+    Legacy one-row-per-round shape, kept for existing queries. Backed by the
+    read-only `api_game_compat` view over `Session`/`Round`; see the
+    `migrate_game_sessions` management command.
+    """
+
     class InfoType(models.TextChoices):
         INFO = 'INFO'
         CHAT = 'CHAT'
@@ -50,6 +170,14 @@ class Game(models.Model):
     state = models.JSONField(name="state", default=dict)
     actions = models.JSONField(name="actions", default=dict)
 
+    with_bot = models.BooleanField(name="with_bot", default=False)
+
+    objects = GameQuerySet.as_manager()
+
+    class Meta:
+        managed = False
+        db_table = "api_game_compat"
+
     @staticmethod
     def get_prob(x):
         total = Game.objects.count()
@@ -59,16 +187,61 @@ class Game(models.Model):
             prob = [1 - Game.objects.filter(info_type__contains=[i]).count() / total for i in x]
             return prob
 
+    # Completed sessions have `ended_at` set by the outro round. Checking them instead of the
+    # rounds keeps these live queries off the (partitioned, archived) round history.
+
     @staticmethod
     def player_has_participated(email):
-        server_count = Game.objects.filter(server__email=email, game_name="outro").count()
-        client_count = Game.objects.filter(client__email=email, game_name="outro").count()
-        return max(server_count, client_count) > 0
+        return Session.completed_by(email).exists() or GroupSession.completed_by(email).exists()
+
+    @staticmethod
+    async def aplayer_has_participated(email):
+        """Async `player_has_participated`, for the async views"""
+        return await Session.completed_by(email).aexists() or await GroupSession.completed_by(email).aexists()
 
     @staticmethod
     def players_hava_played(player_one, player_two):
-        server_count = Game.objects.filter(server__email=player_one, client__email=player_two,
-                                           game_name="outro").count()
-        client_count = Game.objects.filter(server__email=player_two, client__email=player_two,
-                                           game_name="outro").count()
-        return max(server_count, client_count) > 0
+        return Session.objects.filter(
+            models.Q(server_id=player_one, client_id=player_two) | models.Q(server_id=player_two, client_id=player_one),
+            ended_at__isnull=False
+        ).exists()
+
+
+class GroupSession(models.Model):
+    """The rounds of an N-player group game played by one group, with players in seat order"""
+    session_id = models.UUIDField(name="session_id", primary_key=True, default=uuid.uuid4)
+    group_id = models.CharField(name="group_id", max_length=100, db_index=True)
+    game_name = models.CharField(name="game_name", max_length=100)
+    players = ArrayField(models.EmailField(), default=list)
+    info_type = ArrayField(models.CharField(max_length=10), default=list)
+
+    started_at = models.DateTimeField(name="started_at", default=datetime.now)
+    ended_at = models.DateTimeField(name="ended_at", null=True)
+
+    @staticmethod
+    def completed_by(email):
+        return GroupSession.objects.filter(players__contains=[email], ended_at__isnull=False)
+
+
+class GroupRound(models.Model):
+    """A round of an N-player group game, with actions and payoffs keyed by player email"""
+    round_id = models.UUIDField(name="round_id", primary_key=True, default=uuid.uuid4)
+    # Rounds saved before group sessions were recorded have none
+    session = models.ForeignKey(name="session", related_name="rounds", to=GroupSession, on_delete=models.CASCADE,
+                                null=True)
+    group_id = models.CharField(name="group_id", max_length=100, db_index=True)
+    game_name = models.CharField(name="game_name", max_length=100)
+    round_no = models.IntegerField(name="round_no")
+    players = ArrayField(models.EmailField(), default=list)
+    info_type = ArrayField(models.CharField(max_length=10), default=list)
+    actions = models.JSONField(name="actions", default=dict)
+    payoffs = models.JSONField(name="payoffs", default=dict)
+    created_at = models.DateTimeField(name="created_at", default=datetime.now)
+
+
+class ChatMessage(models.Model):
+    message_id = models.BigAutoField(name="message_id", primary_key=True)
+    group_id = models.CharField(name="group_id", max_length=100, db_index=True)
+    sender = models.ForeignKey(name="sender", related_name="chat_messages", to=Player, on_delete=models.CASCADE)
+    message = models.JSONField(name="message", null=True)
+    sent_at = models.DateTimeField(name="sent_at", default=datetime.now)
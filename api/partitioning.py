@@ -0,0 +1,119 @@
+"""
+Monthly range partitions of api_round on created_at. The `0004_partition_rounds`
+migration converts the table, `partition_rounds` creates partitions ahead and
+`archive_rounds` detaches old ones.
+
+Django's migration state still has round_id as Round's primary key, while
+the table's is (round_id, created_at), as unique constraints on a partitioned
+table must contain the partition key. Lookups by round_id are unaffected;
+schema changes to round_id or created_at need hand-written SQL.
+"""
+from datetime import date
+
+TABLE = "api_round"
+FK_NAME = f"{TABLE}_session_id_fk"
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(start: date) -> str:
+    return f"{TABLE}_y{start.year}m{start.month:02d}"
+
+
+def partition_start(name: str):
+    """Inverse of `partition_name`, None for partitions not named after a month"""
+    try:
+        year, month = name[len(TABLE) + 2:].split("m")
+        return date(int(year), int(month), 1)
+    except ValueError:
+        return None
+
+
+def is_partitioned(cursor) -> bool:
+    cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [TABLE])
+    row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def list_partitions(cursor):
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = %s::regclass ORDER BY c.relname", [TABLE]
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def create_partition(cursor, start: date):
+    """Creates the partition of the month starting at `start`, moving its rows out of the default partition"""
+    name = partition_name(start)
+    if name in list_partitions(cursor):
+        return
+    end = add_months(start, 1)
+    # Postgres refuses a new partition while the default one holds rows in its range
+    cursor.execute(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS)")
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {TABLE}_default WHERE created_at >= %s AND created_at < %s RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved", [start, end]
+    )
+    cursor.execute(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", [start, end])
+
+
+def rebuild(cursor, partitioned: bool):
+    """
+    Recreates api_round, range-partitioned by month with a default partition
+    or as a plain table, and copies its rows, indexes and the views over it.
+    """
+    old = f"{TABLE}_old"
+
+    cursor.execute(
+        "SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = %s::regclass AND NOT indisprimary", [TABLE]
+    )
+    index_defs = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'", [TABLE])
+    primary_key = cursor.fetchone()[0]
+    cursor.execute(
+        "SELECT DISTINCT v.relname, pg_get_viewdef(v.oid) FROM pg_depend d "
+        "JOIN pg_rewrite w ON w.oid = d.objid JOIN pg_class v ON v.oid = w.ev_class "
+        "WHERE d.refobjid = %s::regclass AND v.relkind = 'v'", [TABLE]
+    )
+    views = cursor.fetchall()
+    cursor.execute(f"SELECT min(created_at)::date FROM {TABLE}")
+    first = cursor.fetchone()[0] or date.today()
+
+    for name, _ in views:
+        cursor.execute(f"DROP VIEW {name}")
+    cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {old}")
+    cursor.execute(f"ALTER TABLE {old} RENAME CONSTRAINT {primary_key} TO {old}_pkey")
+
+    if partitioned:
+        cursor.execute(f"CREATE TABLE {TABLE} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+        # Unique constraints on a partitioned table must contain the partition key
+        cursor.execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (round_id, created_at)")
+        cursor.execute(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT")
+        start, end = month_start(first), month_start(date.today())
+        while start <= end:
+            create_partition(cursor, start)
+            start = add_months(start, 1)
+    else:
+        cursor.execute(f"CREATE TABLE {TABLE} (LIKE {old} INCLUDING DEFAULTS)")
+        cursor.execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (round_id)")
+    cursor.execute(
+        f"ALTER TABLE {TABLE} ADD CONSTRAINT {FK_NAME} FOREIGN KEY (session_id) "
+        f"REFERENCES api_session (session_id) DEFERRABLE INITIALLY DEFERRED"
+    )
+
+    cursor.execute(f"INSERT INTO {TABLE} SELECT * FROM {old}")
+    # Run the deferred FK checks now, tables can't be dropped or indexed with trigger events pending
+    cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+    cursor.execute(f"DROP TABLE {old}")
+    for index_def in index_defs:
+        cursor.execute(index_def.replace(" ON ONLY ", " ON ").replace(f" ON public.{TABLE} ", f" ON {TABLE} "))
+    for name, view_def in views:
+        cursor.execute(f"CREATE VIEW {name} AS {view_def}")
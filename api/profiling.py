@@ -0,0 +1,121 @@
+"""
+Timing for consumer handlers. `profiled` handlers record how long they took and
+how much of that went to each category marked with `timed` (lobby cache,
+channel layer, ORM, serialization, logging) and log the ones over
+SLOW_MESSAGE_MS. Connections sampled via PROFILE_SAMPLE_RATE also run their
+handlers under cProfile.
+"""
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from asgiref.sync import async_to_sync as asgiref_async_to_sync
+from django.conf import settings
+from django.db import connection
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+@contextmanager
+def timed(category):
+    """Adds the time spent in the block to `category` of the handler being profiled, if any"""
+    spent = getattr(_local, "spent", None)
+    if spent is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spent[category] += time.perf_counter() - start
+
+
+def async_to_sync(awaitable):
+    """asgiref's async_to_sync, timed as channel layer time"""
+    call = asgiref_async_to_sync(awaitable)
+
+    @functools.wraps(call)
+    def wrapper(*args, **kwargs):
+        with timed("channel_layer"):
+            return call(*args, **kwargs)
+
+    return wrapper
+
+
+def _time_query(execute, sql, params, many, context):
+    with timed("orm"):
+        return execute(sql, params, many, context)
+
+
+def profiled(handler):
+    @functools.wraps(handler)
+    def wrapper(self, *args, **kwargs):
+        if getattr(_local, "spent", None) is not None:
+            # Nested call, e.g. a bot's move from game_start, counts towards the outer handler
+            return handler(self, *args, **kwargs)
+
+        label = handler.__name__
+        if args and isinstance(args[0], dict) and args[0].get("type") != label:
+            label = f"{label}:{args[0].get('type')}"
+
+        _local.spent = defaultdict(float)
+        profiler = getattr(self, "profiler", None)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(_time_query):
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    return handler(self, *args, **kwargs)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            spent, _local.spent = _local.spent, None
+            _report(label, self.channel_name, time.perf_counter() - start, spent)
+
+    return wrapper
+
+
+def _report(label, channel_name, total, spent):
+    if total * 1000 < settings.SLOW_MESSAGE_MS:
+        return
+
+    breakdown = {k: round(v * 1000, 2) for k, v in spent.items()}
+    breakdown["other"] = round((total - sum(spent.values())) * 1000, 2)
+    log.warning(json.dumps({
+        "event": "slow_message",
+        "handler": label,
+        "channel": channel_name,
+        "total_ms": round(total * 1000, 2),
+        "breakdown_ms": breakdown
+    }))
+
+
+def sample_profiler():
+    """A profiler for a PROFILE_SAMPLE_RATE fraction of connections, read at each connect"""
+    if random.random() < float(os.environ.get("PROFILE_SAMPLE_RATE", 0)):
+        return cProfile.Profile()
+    return None
+
+
+def dump_profile(profiler, channel_name):
+    if settings.PROFILE_DIR:
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(settings.PROFILE_DIR, f"{channel_name}.prof"))
+    else:
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(25)
+        log.info(f"Profile of {channel_name}:\n{out.getvalue()}")
@@ -0,0 +1,96 @@
+"""
+Bulk provisioning of pre-registered players from CSV. Rows are copied into
+a temporary staging table and merged into api_player with one INSERT for
+new players and one UPDATE for existing ones, so a cohort of any size costs
+a single COPY and two statements instead of an update_or_create per player.
+"""
+import csv
+
+from django.db import connection, transaction
+
+from api.models import Player
+
+STAGING = "player_import"
+
+# Columns a CSV may set, with what new rows get when a column is left out or blank
+COLUMNS = {
+    "email": None,
+    "name": "''",
+    "avatar": "''",
+    "hall": "''",
+    "year": "''",
+    "department": "''",
+    "roll_no": "''",
+    "upi_id": "NULL",
+    "gender": "'M'",
+}
+
+
+def read_header(f):
+    """Reads the CSV header of `f`, a binary file positioned at its start, and checks its columns"""
+    header = next(csv.reader([f.readline().decode("utf-8-sig")]), [])
+    columns = [c.strip() for c in header]
+    unknown = [c for c in columns if c not in COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    if "email" not in columns:
+        raise ValueError("An email column is required")
+    if len(set(columns)) != len(columns):
+        raise ValueError("Duplicate columns")
+    return columns
+
+
+def import_players(f):
+    """
+    Creates or updates the players in CSV file `f` (binary, with a header
+    row). Emails are trimmed and lowercased. Blank fields, and columns left
+    out of the file, keep their values on existing players and take the
+    column's default on new ones. When an email appears more than once, its
+    last row wins. Returns the number of players created and updated.
+    """
+    columns = read_header(f)
+    names = ", ".join(columns)
+    fields = [c for c in COLUMNS if c != "email"]
+    updated = [c for c in columns if c != "email"]
+    table = Player._meta.db_table
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMP TABLE {STAGING} (line serial, {', '.join(f'{c} text' for c in columns)}) ON COMMIT DROP"
+        )
+        # The header was consumed above, the rest of the file is data
+        with connection.wrap_database_errors:
+            cursor.copy_expert(f"COPY {STAGING} ({names}) FROM STDIN WITH CSV", f)
+        # One row per email, blank fields as NULL
+        cursor.execute(f"""
+            CREATE TEMP TABLE {STAGING}_latest ON COMMIT DROP AS
+            SELECT DISTINCT ON (lower(trim(email)))
+                   lower(trim(email)) AS email{''.join(f", NULLIF(trim({c}), '') AS {c}" for c in updated)}
+            FROM {STAGING}
+            WHERE trim(email) <> ''
+            ORDER BY lower(trim(email)), line DESC
+        """)
+        cursor.execute(f"""
+            INSERT INTO {table} (email, {', '.join(fields)}, is_bot)
+            SELECT email, {', '.join(f"COALESCE({c}, {COLUMNS[c]})" if c in columns else COLUMNS[c] for c in fields)},
+                   false
+            FROM {STAGING}_latest
+            ON CONFLICT (email) DO NOTHING
+            RETURNING email
+        """)
+        created = [row[0] for row in cursor.fetchall()]
+
+        changed = 0
+        if updated:
+            # A separate statement, so players created concurrently since are updated too
+            cursor.execute(f"""
+                UPDATE {table} p
+                SET {', '.join(f"{c} = COALESCE(s.{c}, p.{c})" for c in updated)}
+                FROM {STAGING}_latest s
+                WHERE p.email = s.email AND NOT p.email = ANY(%s)
+            """, [created])
+            changed = cursor.rowcount
+        # Within an outer transaction, ON COMMIT comes too late for the next import
+        cursor.execute(f"DROP TABLE {STAGING}, {STAGING}_latest")
+
+    return len(created), changed
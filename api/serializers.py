@@ -1,15 +1,21 @@
 from rest_framework import serializers
 
-from api.models import Player, Game
+from api.models import Player, Game, ChatMessage
 
 
 class PlayerSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Player
-        fields = ['name', 'email', 'avatar', 'hall', 'year', 'department', 'upi_id', 'gender', 'roll_no']
+        fields = Player.PROFILE_FIELDS
 
 
 class GameSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Game
         fields = ['game_id', 'player_one', 'player_two', 'created_at', 'last_played', 'state', 'finished', 'game_type']
+
+
+class ChatMessageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ChatMessage
+        fields = ['message_id', 'group_id', 'sender', 'message', 'sent_at']
@@ -0,0 +1,90 @@
+"""
+Sharding of the channel layer and the lobby over several Redis servers
+(REDIS_SHARDS). Names are placed on a hash ring with virtual nodes, so adding
+a server only moves the names on its arcs.
+
+All channels of a worker process share one inbox key, which is placed on the
+worker's shard. Each shard has its own lobby, and groups matched from it are
+named to land on the same shard. A group's membership, its members' inboxes
+and its messages then share one Redis server, so group_send and the scripted
+lobby transitions stay single-node.
+"""
+import bisect
+import hashlib
+import os
+import uuid
+
+from channels_redis.core import RedisChannelLayer
+from django.core.exceptions import ImproperlyConfigured
+
+from api.utils import random_str
+
+
+class HashRing:
+    """Maps keys to nodes, each node owning `vnodes` points on the ring"""
+
+    def __init__(self, nodes, vnodes=64):
+        points = sorted((self.hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self.hashes = [h for h, _ in points]
+        self.nodes = [n for _, n in points]
+
+    @staticmethod
+    def hash(key):
+        if isinstance(key, str):
+            key = key.encode("utf8")
+        return int.from_bytes(hashlib.md5(key).digest()[:8], "big")
+
+    def node(self, key):
+        return self.nodes[bisect.bisect(self.hashes, self.hash(key)) % len(self.nodes)]
+
+
+class ShardedChannelLayer(RedisChannelLayer):
+    """
+    RedisChannelLayer placing channels and groups with a HashRing. The worker's
+    shard is `shard`, or its pid modulo the number of shards if unset.
+    """
+    sharded = True
+
+    def __init__(self, hosts=None, vnodes=64, shard=None, **kwargs):
+        super().__init__(hosts=hosts, **kwargs)
+        # Servers are identified by address, so reordering REDIS_SHARDS moves nothing
+        labels = [self.label(i) for i in range(self.ring_size)]
+        if len(set(labels)) != len(labels):
+            raise ImproperlyConfigured("REDIS_SHARDS lists a server more than once")
+        if shard is not None and not 0 <= shard < self.ring_size:
+            raise ImproperlyConfigured(f"REDIS_SHARD must be between 0 and {self.ring_size - 1}, not {shard}")
+
+        self.ring = HashRing(labels, vnodes)
+        self.indexes = {label: i for i, label in enumerate(labels)}
+        self.shard = os.getpid() % self.ring_size if shard is None else shard
+
+        while self.consistent_hash(f"specific.{self.client_prefix}!") != self.shard:
+            self.client_prefix = uuid.uuid4().hex
+        self.lobby_groups = [self.lobby_group(i) for i in range(self.ring_size)]
+
+    def label(self, index):
+        host = self.hosts[index]
+        return host.get("address") or f"{host.get('host')}:{host.get('port')}"
+
+    def consistent_hash(self, value):
+        if isinstance(value, bytes):
+            value = value.decode("utf8")
+        # Process-local channels live in their process' inbox, also when a message is sent to them
+        if "!" in value:
+            value = self.non_local_name(value)
+        return self.indexes[self.ring.node(value)]
+
+    def new_group_name(self, shard=None):
+        """A new random group name that is placed on `shard`, this worker's by default"""
+        shard = self.shard if shard is None else shard
+        while True:
+            name = random_str()
+            if self.consistent_hash(name) == shard:
+                return name
+
+    def lobby_group(self, shard):
+        # The same for every worker, as long as the shards are
+        i = 0
+        while self.consistent_hash(f"lobby.{i}") != shard:
+            i += 1
+        return f"lobby.{i}"
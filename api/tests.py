@@ -1,3 +1,893 @@
-from django.test import TestCase
+import io
+import json
+import os
+import pickle
+import pstats
+import runpy
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import date, datetime, timezone
+from unittest import mock
+from urllib.parse import urlencode
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+from channels_redis.core import RedisChannelLayer
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from mtp_backend.postgres_pool.base import DatabaseWrapper
+from .admission import Admission, Waiting
+from .analysis import GAME_INDEX, analyze, human_rounds, load_chunks
+from .chat import ChatBuffer
+from .consumers import GameConsumer, C, COMMANDS_LIST, Active, admission
+from .drain import Checkpoint, drain
+from .games import get_game, get_group_game
+from .legacy import convert
+from .lobby import LobbyEntry
+from .models import Player, Session, Round, ChatMessage, Game, GroupSession
+from .partitioning import add_months, create_partition, is_partitioned, list_partitions, month_start
+from .provisioning import import_players
+from .sharding import HashRing, ShardedChannelLayer
+from .throttling import TokenBucket, backlog
+from .tracing import SpanExporter, stamp, traced
+from . import utils, views
+from .transitions import read_lobby, update_lobby, move_to_group, leave_lobby, pipelined, lobby_group, new_group_name
+
+try:
+    import redislite
+except ImportError:
+    redislite = None
+
+_redis_servers = []
+
+
+def redis_url(index=0):
+    """URL of a throwaway Redis server, started on first use"""
+    while len(_redis_servers) <= index:
+        _redis_servers.append(redislite.Redis())
+    return f"unix://{_redis_servers[index].socket_file}"
+
+
+class RedisCacheMixin:
+    """Runs the test case with the cache on Redis, skipped without redislite"""
+
+    @classmethod
+    def setUpClass(cls):
+        if redislite is None:
+            raise unittest.SkipTest("redislite is needed for a throwaway Redis server")
+        cls.redis_settings = override_settings(CACHES={"default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": redis_url(),
+        }})
+        cls.redis_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.redis_settings.disable()
+
+
+def create_player(email, **fields):
+    profile = {"name": email.split("@")[0], "avatar": "", "hall": "", "year": "", "department": "", **fields}
+    return Player.objects.create(email=email, **profile)
+
+
+class ConnectionPoolTest(TestCase):
+    def test_pool_follows_settings(self):
+        # Connections made before the test runner switched NAME must not be reused
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT current_database()")
+            self.assertEqual(cursor.fetchone()[0], connection.settings_dict["NAME"])
+
+        wrapper = DatabaseWrapper({**connection.settings_dict}, alias="pool_test")
+        params = wrapper.get_connection_params()
+        self.assertIs(wrapper.get_pool(params), wrapper.get_pool({**params}))
+        self.assertIsNot(wrapper.get_pool(params), wrapper.get_pool({**params, "database": "other"}))
+
+
+class GameStartTest(TestCase):
+    def setUp(self):
+        self.server = create_player("server@x", hall="RK")
+        self.client_player = create_player("client@x", hall="LBS")
+        self.entries = [LobbyEntry.of(self.server, "specific.a!1"), LobbyEntry.of(self.client_player, "specific.b!2")]
+
+        self.consumer = GameConsumer()
+        self.consumer.channel_name = "specific.a!1"
+        self.consumer.player = self.server
+        self.sent = []
+        self.consumer.send_json = self.sent.append
+
+    def start(self, game_id, info_type):
+        game = get_game("group", *self.entries, info_type=info_type, game_id=game_id)
+        self.consumer.game_start({"type": C.GAME_START, "data": pickle.dumps(game)})
+        return self.sent[-1]["data"]
+
+    def test_payload(self):
+        data = self.start(2, ["INFO", "CHAT"])
+        self.assertTrue(data["is_server"])
+        self.assertEqual(data["opponent"], self.client_player.profile())
+        self.assertEqual(data["info_type"], ["INFO", "CHAT"])
+        self.assertEqual((data["game_id"], data["scores"]), (2, [0, 0]))
+
+    def test_info_type_per_game(self):
+        self.start(2, ["INFO", "CHAT"])
+        # The opponent's profile is only loaded for the first game of the session
+        with self.assertNumQueries(0):
+            data = self.start(6, ["INFO", "CHAT"])
+        self.assertEqual(data["info_type"], [])
+        self.assertEqual(data["opponent"]["email"], "client@x")
+
+    def test_leaves_worker_lobby(self):
+        # Matched by a consumer on another worker, the player is only counted out of its lobby here
+        admission.enter_lobby(self.consumer.channel_name)
+        self.addCleanup(admission.release, self.consumer.channel_name)
+        self.start(1, ["INFO"])
+        self.assertNotIn(self.consumer.channel_name, admission.lobby)
+
+
+class ThrottlingTest(SimpleTestCase):
+    def setUp(self):
+        self.consumer = GameConsumer()
+        self.consumer.channel_name = "specific.a!1"
+        self.consumer.channel_layer = InMemoryChannelLayer(capacity=100)
+        self.sent = []
+        self.consumer.send_json = self.sent.append
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=1, burst=2)
+        self.assertEqual([bucket.consume() for _ in range(3)], [True, True, False])
+        self.assertAlmostEqual(bucket.retry_after(), 1, places=1)
+
+    def test_channel_full(self):
+        async def send(channel, message):
+            raise ChannelFull()
+
+        self.assertFalse(self.consumer.forward(C.CHAT, send, "specific.b!2", {"type": C.CHAT}))
+        self.assertEqual(self.sent[-1]["type"], C.THROTTLED)
+        self.assertEqual(self.sent[-1]["data"]["reason"], "channel_full")
+
+    @override_settings(WORKER_BACKLOG_LIMIT=10)
+    def test_worker_busy(self):
+        layer = self.consumer.channel_layer
+        # Every channel is under capacity, the worker as a whole is not
+        for i in range(10):
+            async_to_sync(layer.send)(f"specific.a!{i % 5}", {"type": C.CHAT})
+        self.assertEqual(backlog(layer), 10)
+
+        self.assertFalse(self.consumer.forward(C.CHAT, layer.send, "specific.b!2", {"type": C.CHAT}))
+        self.assertEqual(self.sent[-1]["data"]["reason"], "worker_busy")
+
+        async_to_sync(layer.receive)("specific.a!0")
+        self.assertTrue(self.consumer.forward(C.CHAT, layer.send, "specific.b!2", {"type": C.CHAT}))
+
+    def test_backlog_of_redis_layer(self):
+        layer = RedisChannelLayer(hosts=["redis://localhost:1"])
+        self.assertEqual(backlog(layer), 0)
+        for i in range(3):
+            layer.receive_buffer[f"specific.a!{i}"].put_nowait({"type": C.CHAT})
+        self.assertEqual(backlog(layer), 3)
+
+    def test_rate_limited_before_logging(self):
+        self.consumer.group_id = "waiting"
+        self.consumer.buckets = {"game": TokenBucket(rate=0.001, burst=1)}
+        with mock.patch("api.consumers.dumps", return_value="") as dumps:
+            self.consumer.receive_json({"type": C.RETRY_MATCHING})
+            self.consumer.receive_json({"type": C.RETRY_MATCHING})
+        self.assertEqual(dumps.call_count, 1)
+        self.assertEqual(self.sent[-1]["data"]["reason"], "rate_limited")
+
+    def test_server_only_types_not_forwarded(self):
+        self.consumer.group_id = "group"
+        self.consumer.forward = mock.Mock()
+        for message_type in C.SERVER_ONLY:
+            self.assertNotIn(message_type, COMMANDS_LIST)
+            self.consumer.receive_json({"type": message_type})
+        self.consumer.forward.assert_not_called()
+
+
+class WaitingRoomTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_fifo(self):
+        self.assertEqual([Waiting.add(c) for c in "abc"], [1, 2, 3])
+        self.assertEqual(Waiting.add("d", front=True), 1)
+        Waiting.delete("b")
+        self.assertEqual(Waiting.all(), ["d", "a", "c"])
+        self.assertEqual(Waiting.position("c"), 3)
+        self.assertEqual(Waiting.pop(2), ["d", "a"])
+        self.assertEqual(Waiting.pop(float("inf")), ["c"])
+        self.assertEqual(Waiting.pop(1), [])
+
+    def test_readd_moves_to_back(self):
+        Waiting.add("a")
+        Waiting.add("b")
+        self.assertEqual(Waiting.add("a"), 2)
+        self.assertEqual(Waiting.all(), ["b", "a"])
+
+    def test_expired(self):
+        Waiting.add("a")
+        with mock.patch("api.admission.now", return_value=int(1e12)):
+            self.assertEqual(Waiting.all(), [])
+            self.assertEqual(Waiting.add("b"), 1)
+
+    def test_cluster_connections(self):
+        workers = [Admission({}), Admission({})]
+        workers[1].worker_id += ":other"
+        workers[0].enter_lobby("a")
+        workers[1].enter_lobby("b")
+        workers[1].admit("c")
+        self.assertEqual(workers[0].cluster_connections(), 3)
+        workers[1].release("b")
+        self.assertEqual(workers[0].cluster_connections(), 2)
+        with mock.patch("api.admission.now", return_value=int(1e12)):
+            self.assertEqual(workers[0].cluster_connections(), 0)
+        for worker in workers:
+            worker.connections.clear()
+            worker.publish()
+
+
+class RedisWaitingRoomTest(RedisCacheMixin, WaitingRoomTest):
+    def test_concurrent(self):
+        def add(channels):
+            for c in channels:
+                Waiting.add(c)
+
+        threads = [threading.Thread(target=add, args=([f"{i}.{j}" for j in range(20)],)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        queue = Waiting.all()
+        self.assertEqual(len(queue), 80)
+        # Each worker's channels keep their order
+        for i in range(4):
+            self.assertEqual([c for c in queue if c.startswith(f"{i}.")], [f"{i}.{j}" for j in range(20)])
+
+        popped = []
+        threads = [threading.Thread(target=lambda: popped.extend(Waiting.pop(10))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(popped), sorted(queue))
+
+
+class ShardingTest(SimpleTestCase):
+    hosts = ["redis://localhost:6380", "redis://localhost:6381", "redis://localhost:6382"]
+
+    def test_ring_moves_only_removed_node_keys(self):
+        keys = [f"group.{i}" for i in range(3000)]
+        ring, smaller = HashRing(["a", "b", "c"]), HashRing(["a", "b"])
+        placed = [ring.node(k) for k in keys]
+        self.assertTrue(all(800 < placed.count(n) < 1200 for n in "abc"))
+        self.assertTrue(all(smaller.node(k) == n for k, n in zip(keys, placed) if n != "c"))
+
+    def test_placement(self):
+        for shard in range(3):
+            layer = ShardedChannelLayer(hosts=self.hosts, shard=shard)
+            self.assertEqual(layer.consistent_hash(f"specific.{layer.client_prefix}!x"), shard)
+            self.assertEqual(layer.consistent_hash(layer.new_group_name()), shard)
+            self.assertEqual([layer.consistent_hash(g) for g in layer.lobby_groups], [0, 1, 2])
+
+    def test_invalid_config(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ShardedChannelLayer(hosts=self.hosts, shard=3)
+        with self.assertRaises(ImproperlyConfigured):
+            ShardedChannelLayer(hosts=self.hosts + self.hosts[:1])
+
+
+class LobbyEntryTest(SimpleTestCase):
+    def test_pickle(self):
+        entry = LobbyEntry("a@x", "specific.a!1", hall="RK", year="2", department="CS", gender="F", is_bot=True)
+        self.assertEqual(pickle.loads(pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)), entry)
+        self.assertNotEqual(LobbyEntry("a@x", "specific.a!1"), entry)
+
+    def test_in_process_lobby(self):
+        cache.clear()
+        layer = InMemoryChannelLayer()
+        entry = LobbyEntry("a@x", "specific.a!1", hall="RK", year="2", department="CS", gender="F", is_bot=True)
+        update_lobby(layer, lambda entries: {**entries, entry.channel_name: {"data": entry, "ttl": 2 ** 40}})
+        self.assertEqual(read_lobby(layer).players(), {entry.channel_name: entry})
+
+
+class LobbyTransitionTest(RedisCacheMixin, SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.layer = self.channel_layer()
+        patcher = mock.patch("api.consumers.get_channel_layer", return_value=self.layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def channel_layer(self):
+        return RedisChannelLayer(hosts=[redis_url()])
+
+    def enter(self, *emails):
+        channels = {}
+        for email in emails:
+            channels[email] = async_to_sync(self.layer.new_channel)()
+            async_to_sync(self.layer.group_add)(lobby_group(self.layer), channels[email])
+            Active.set(channels[email], LobbyEntry(email, channels[email]))
+        return channels
+
+    def test_pipelined(self):
+        self.assertTrue(pipelined(self.layer))
+
+    def test_move_to_group(self):
+        channels = self.enter("a@x", "b@x", "c@x")
+        lobby = read_lobby(self.layer)
+        moved = [channels["a@x"], channels["b@x"]]
+        group = new_group_name(self.layer)
+        self.assertTrue(move_to_group(self.layer, lobby, moved, group, {"type": C.GAME_START, "data": b""}))
+
+        self.assertEqual(list(read_lobby(self.layer).players()), [channels["c@x"]])
+        for channel in moved:
+            self.assertEqual(async_to_sync(self.layer.receive)(channel)["type"], C.GAME_START)
+        # The lobby changed since it was read, so a second move fails
+        self.assertFalse(move_to_group(self.layer, lobby, [channels["c@x"]], group, {"type": C.GAME_START}))
+        self.assertFalse(leave_lobby(self.layer, lobby, channels["c@x"]))
+
+    def test_update_does_not_restore_moved_players(self):
+        channels = self.enter("a@x", "b@x")
+        moved = list(channels.values())
+
+        def change(entries):
+            # A transition moves the players after the update read the lobby, the update is then retried
+            if moved[0] in entries:
+                lobby = read_lobby(self.layer)
+                self.assertTrue(move_to_group(self.layer, lobby, moved, new_group_name(self.layer), {"type": C.GAME_START}))
+            entries["c"] = {"data": LobbyEntry("c@x", "c"), "ttl": 2 ** 40}
+            return entries
+
+        update_lobby(self.layer, change)
+        self.assertEqual(list(read_lobby(self.layer).players()), ["c"])
+
+    def test_entries_round_trip(self):
+        entry = LobbyEntry("a@x", "specific.a!1", hall="RK", year="2", department="CS", gender="F", is_bot=True)
+        update_lobby(self.layer, lambda entries: {**entries, entry.channel_name: {"data": entry, "ttl": 2 ** 40}})
+        read = read_lobby(self.layer).players()[entry.channel_name]
+        self.assertEqual(read, entry)
+        self.assertEqual(read.fields(), ("a@x", "specific.a!1", "RK", "2", "CS", "F", True))
+
+    def test_active(self):
+        channels = self.enter("a@x", "b@x")
+        # Reconnecting replaces the player's previous channel
+        Active.set("new", LobbyEntry("a@x", "new"))
+        self.assertEqual(set(Active.all()), {channels["b@x"], "new"})
+        Active.delete("new")
+        self.assertEqual(list(Active.all()), [channels["b@x"]])
+        self.assertEqual(Active.count(), 1)
+
+
+class ShardedLobbyTransitionTest(LobbyTransitionTest):
+    def setUp(self):
+        super().setUp()
+        for server in _redis_servers:
+            server.flushall()
+
+    def channel_layer(self):
+        return ShardedChannelLayer(hosts=[redis_url(i) for i in range(3)], shard=1)
+
+    def test_lobby_per_shard(self):
+        channels = self.enter("a@x")
+        self.assertEqual(list(read_lobby(self.layer, 1).players()), [channels["a@x"]])
+        self.assertEqual(read_lobby(self.layer, 0).players(), {})
+        other = ShardedChannelLayer(hosts=[redis_url(i) for i in range(3)], shard=0)
+        self.assertEqual(list(read_lobby(other, 1).players()), [channels["a@x"]])
+
+
+class LegacyConversionTest(TestCase):
+    def setUp(self):
+        for email in ["a@x", "b@x"]:
+            create_player(email)
+
+    def legacy_row(self, game_name, info_type, minute, state):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO api_game (game_id, game_name, info_type, group_id, server_id, client_id, created_at, "
+                "state, actions) VALUES (gen_random_uuid(), %s, %s, 'g', 'a@x', 'b@x', %s, %s, '[]')",
+                [game_name, info_type, datetime(2023, 3, 1, 12, minute, tzinfo=timezone.utc), json.dumps(state)]
+            )
+
+    def test_convert(self):
+        self.legacy_row("restaurant", ["INFO"], 0, {"a@x": "high", "b@x": "low"})
+        self.legacy_row("investment", ["INFO"], 1, {"a@x": 4, "b@x": 2.5})
+        self.legacy_row("outro", [], 2, {"a@x": {"trust": 5, "know": True}, "b@x": {"trust": 3, "know": False}})
+        self.assertEqual(convert(), (1, 3))
+        self.assertEqual(convert(), (0, 0))
+
+        session = Session.objects.get()
+        self.assertEqual(session.info_type, ["INFO"])
+        self.assertEqual(session.ended_at, datetime(2023, 3, 1, 12, 2, tzinfo=timezone.utc))
+
+        games = list(Game.objects.order_by("created_at"))
+        self.assertEqual([g.game_name for g in games], ["restaurant", "investment", "outro"])
+        self.assertEqual([g.info_type for g in games], [["INFO"], ["INFO"], []])
+        self.assertEqual(games[0].state, {"a@x": "high", "b@x": "low"})
+        self.assertEqual(games[1].state, {"a@x": 4, "b@x": 2.5})
+        self.assertEqual(games[2].state, {"a@x": {"trust": 5, "know": True}, "b@x": {"trust": 3, "know": False}})
+        self.assertEqual(games[0].actions, [{"sender": "a@x", "data": "high"}, {"sender": "b@x", "data": "low"}])
+        # Scored by the game classes on the way in
+        self.assertIsNotNone(Round.objects.get(game_name="restaurant").server_payoff)
+
+
+class PartitionTest(TestCase):
+    def setUp(self):
+        create_player("a@x")
+        create_player("b@x")
+        self.session = Session.objects.create(group_id="g", server_id="a@x", client_id="b@x")
+
+    def partition_of(self, game_round):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT tableoid::regclass::text FROM api_round WHERE round_id = %s", [game_round.round_id])
+            return cursor.fetchone()[0]
+
+    def test_new_months(self):
+        with connection.cursor() as cursor:
+            self.assertTrue(is_partitioned(cursor))
+        call_command("partition_rounds", ahead=1, stdout=io.StringIO())
+
+        next_month = add_months(month_start(date.today()), 1)
+        game_round = Round.objects.create(session=self.session, game_name="intro",
+                                          created_at=datetime.combine(next_month, datetime.min.time(), timezone.utc))
+        self.assertEqual(self.partition_of(game_round), f"api_round_y{next_month.year}m{next_month.month:02d}")
+
+        # Months without a partition yet land in the default one, and move once it is created
+        later = add_months(next_month, 12)
+        game_round = Round.objects.create(session=self.session, game_name="intro",
+                                          created_at=datetime.combine(later, datetime.min.time(), timezone.utc))
+        self.assertEqual(self.partition_of(game_round), "api_round_default")
+        with connection.cursor() as cursor:
+            # Partitions can't be attached with the deferred FK checks of this test's inserts pending
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            create_partition(cursor, later)
+            self.assertIn(f"api_round_y{later.year}m{later.month:02d}", list_partitions(cursor))
+        self.assertEqual(self.partition_of(game_round), f"api_round_y{later.year}m{later.month:02d}")
+        self.assertEqual(self.session.rounds.count(), 2)
+
+
+class AnalysisTest(TestCase):
+    def setUp(self):
+        state_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(state_dir.cleanup)
+        state_file = override_settings(ANALYSIS_STATE_FILE=os.path.join(state_dir.name, "analysis", "stats.pickle"))
+        state_file.enable()
+        self.addCleanup(state_file.disable)
+        for email in ["a@x", "b@x", "bot@x"]:
+            create_player(email)
+        self.human = Session.objects.create(group_id="h", server_id="a@x", client_id="b@x")
+        self.bot = Session.objects.create(group_id="b", server_id="a@x", client_id="bot@x", with_bot=True)
+
+    def play(self, session, server, client, day):
+        game_round = Round(session=session, game_name="restaurant",
+                           created_at=datetime(2023, 3, day, tzinfo=timezone.utc))
+        game_round.set_actions(server, client)
+        game_round.save()
+
+    def test_humans_only(self):
+        self.play(self.human, "high", "high", 10)
+        self.play(self.bot, "low", "low", 10)
+        results = analyze()
+        self.assertEqual(results["rounds"], 1)
+        self.assertEqual(results["cooperation"]["per_game"]["restaurant"], 1.0)
+
+    def test_late_rounds(self):
+        self.play(self.human, "high", "high", 10)
+        self.assertEqual(analyze()["rounds"], 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(analyze()["rounds"], 1)
+
+        # Restored or converted rounds can be older than those already analyzed
+        self.play(self.human, "low", "low", 5)
+        self.play(self.human, "low", "high", 20)
+        results = analyze()
+        self.assertEqual(results["rounds"], 3)
+        self.assertEqual(results["cooperation"]["per_game"]["restaurant"], 3 / 6)
+        self.assertEqual(analyze(rebuild=True), results)
+
+    def test_treatments(self):
+        self.human.info_type = [Game.InfoType.INFO, Game.InfoType.VIDEO]
+        self.human.save()
+        self.play(self.human, "high", "high", 10)
+        self.play(self.human, None, "low", 11)
+        chunk = next(load_chunks(human_rounds()))
+        np.testing.assert_array_equal(chunk["treatment"], [5, 5])
+        np.testing.assert_array_equal(chunk["game"], [GAME_INDEX["restaurant"]] * 2)
+        np.testing.assert_array_equal(chunk["choice"], [["high", None], ["high", "low"]])
+
+
+class ChatBufferTest(TransactionTestCase):
+    # The timer writes from its own thread and connection, so the data has to be committed
+    def setUp(self):
+        create_player("a@x")
+        self.buffer = ChatBuffer(max_size=3, max_age=0.2)
+
+    def wait_for(self, count):
+        deadline = time.monotonic() + 5
+        while ChatMessage.objects.count() < count and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return ChatMessage.objects.count()
+
+    def test_size(self):
+        for i in range(3):
+            self.buffer.add("g1", "a@x", f"m{i}")
+        self.assertEqual(ChatMessage.objects.count(), 3)
+
+    def test_quiet_group_written_by_timer(self):
+        self.buffer.add("g1", "a@x", "hello")
+        time.sleep(0.1)
+        # Tearing down another group keeps the age of the first
+        self.buffer.add("g2", "a@x", "hi")
+        self.buffer.flush("g2")
+        self.assertEqual(ChatMessage.objects.count(), 1)
+        self.assertEqual(self.wait_for(2), 2)
+        self.assertEqual(self.buffer.size, 0)
+
+
+class ParticipationTest(TestCase):
+    def setUp(self):
+        for email in ["a@x", "b@x", "bot@x"]:
+            create_player(email)
+
+    def finish(self, group_id, server_id, client_id, **fields):
+        session = Session.objects.create(group_id=group_id, server_id=server_id, client_id=client_id,
+                                         ended_at=datetime.now(timezone.utc), **fields)
+        Round.objects.create(session=session, game_name="outro", created_at=session.ended_at)
+        return session
+
+    def test_bot_sessions_dont_count(self):
+        self.finish("b", "a@x", "bot@x", with_bot=True)
+        self.assertFalse(Game.player_has_participated("a@x"))
+
+        self.finish("h", "a@x", "b@x")
+        self.assertTrue(Game.player_has_participated("a@x"))
+        self.assertTrue(Game.player_has_participated("b@x"))
+
+    def test_completed_sessions(self):
+        session = Session.objects.create(group_id="h", server_id="a@x", client_id="b@x")
+        self.assertFalse(Game.player_has_participated("a@x"))
+        self.assertFalse(Game.players_hava_played("a@x", "b@x"))
+
+        session.ended_at = datetime.now(timezone.utc)
+        session.save()
+        # Counted from the session alone, so archiving its rounds changes nothing
+        self.assertTrue(Game.player_has_participated("a@x"))
+        self.assertTrue(Game.players_hava_played("a@x", "b@x"))
+        self.assertTrue(Game.players_hava_played("b@x", "a@x"))
+        self.assertFalse(Game.players_hava_played("b@x", "bot@x"))
+
+
+class GroupGameTest(TestCase):
+    def setUp(self):
+        self.players = [LobbyEntry(f"p{i}@x", f"c{i}") for i in range(3)]
+        for p in self.players:
+            create_player(p.email)
+
+    def play(self, game):
+        for p in self.players:
+            game.update_state({"sender": p.channel_name, "data": 5})
+        game.save()
+
+    def test_session_per_group(self):
+        game = get_group_game("public_goods", "g", self.players, [])
+        for round_no in range(1, game.rounds + 1):
+            game = get_group_game("public_goods", "g", self.players, [], round_no, game.session_id)
+            self.play(game)
+            if round_no == 1:
+                self.assertFalse(Game.player_has_participated("p0@x"))
+
+        session = GroupSession.objects.get()
+        self.assertEqual(session.rounds.count(), game.rounds)
+        self.assertIsNotNone(session.ended_at)
+        for p in self.players:
+            self.assertTrue(Game.player_has_participated(p.email))
+
+    def test_matching_skips_ineligible(self):
+        lobby = [LobbyEntry(f"p{i}@x", f"c{i}") for i in range(3, 6)]
+        for p in lobby:
+            create_player(p.email)
+        Session.objects.create(group_id="h", server_id="p1@x", client_id="p3@x", ended_at=datetime.now(timezone.utc))
+        # Sessions with a bot don't make a player ineligible, but still seat the pair apart
+        Session.objects.create(group_id="b", server_id="p2@x", client_id="p0@x", ended_at=datetime.now(timezone.utc),
+                               with_bot=True)
+
+        consumer = GameConsumer()
+        consumer.player = Player.objects.get(email="p0@x")
+        consumer.lobby_entry = self.players[0]
+        players = {p.channel_name: p for p in self.players[1:] + lobby}
+        matched = consumer.find_players(players, 3)
+        self.assertEqual([p.email for p in matched], ["p0@x", "p4@x", "p5@x"])
+        self.assertIsNone(consumer.find_players(players, 4))
+
+    def test_invalid_contributions(self):
+        game = get_group_game("public_goods", "g", self.players, [])
+        for data in [0, 10, 2.5]:
+            self.assertTrue(game.accepts({"sender": "c0", "data": data}))
+        for data in [-1, 11, "5", True, None, {"trust": 5}]:
+            self.assertFalse(game.accepts({"sender": "c0", "data": data}))
+        self.assertFalse(game.accepts({"sender": "stranger", "data": 5}))
+
+
+class ProfilingTest(TestCase):
+    def setUp(self):
+        profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(profile_dir.cleanup)
+        self.profile_dir = profile_dir.name
+        self.player = create_player("a@x")
+
+    def connect(self, sample_rate):
+        consumer = GameConsumer()
+        consumer.channel_name = "specific.a!1"
+        consumer.scope = {"user": self.player}
+        consumer.close = mock.Mock()
+        # A draining worker closes right after the profiler is picked, the shortest connect there is
+        with override_settings(PROFILE_DIR=self.profile_dir), mock.patch.object(drain, "active", True), \
+                mock.patch.dict(os.environ, {"PROFILE_SAMPLE_RATE": sample_rate}):
+            consumer.connect()
+            consumer.disconnect(1000)
+        consumer.close.assert_called_once()
+
+    def test_sampled_connection(self):
+        self.connect("1")
+        self.assertEqual(os.listdir(self.profile_dir), ["specific.a!1.prof"])
+        stats = pstats.Stats(os.path.join(self.profile_dir, "specific.a!1.prof"))
+        # Handlers after connect run under the profiler
+        self.assertIn("disconnect", {name for _, _, name in stats.stats})
+
+    def test_unsampled_connection(self):
+        self.connect("0")
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+
+class Relay:
+    """Forwards a client message to itself over a (pretend) channel layer hop"""
+    channel_name = "specific.a!1"
+    group_id = "g"
+
+    @traced(root=True)
+    def receive_json(self, content):
+        self.handle_game_event(stamp({"type": "handle_game_event", "data": content}, "channel_layer.send"))
+
+    @traced
+    def handle_game_event(self, event):
+        self.received = event
+
+
+@override_settings(TRACE_SAMPLE_RATE=1, TRACE_COLLECTOR_URL=None)
+class TracingTest(SimpleTestCase):
+    def test_spans_written(self):
+        trace_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(trace_dir.cleanup)
+        trace_file = os.path.join(trace_dir.name, "spans.jsonl")
+        exporter = SpanExporter()
+
+        relay = Relay()
+        with mock.patch("api.tracing._exporter", exporter):
+            relay.receive_json({"type": C.GAME_UPDATE})
+        # The trace context is taken off the message before the handler sees it
+        self.assertEqual(relay.received, {"type": "handle_game_event", "data": {"type": C.GAME_UPDATE}})
+
+        batch = []
+        while not exporter.spans.empty():
+            batch.append(exporter.spans.get())
+        with override_settings(TRACE_FILE=trace_file):
+            exporter.write(batch)
+        with open(trace_file) as f:
+            spans = {span["name"]: span for span in map(json.loads, f)}
+
+        root, hop, handler = spans[f"receive_json:{C.GAME_UPDATE}"], spans["channel_layer.send"], spans["handle_game_event"]
+        self.assertNotIn("parentId", root)
+        self.assertEqual(hop["parentId"], root["id"])
+        self.assertEqual(handler["parentId"], hop["id"])
+        for span in spans.values():
+            self.assertEqual(span["traceId"], root["traceId"])
+            self.assertEqual(len(span["traceId"]), 32)
+            self.assertGreaterEqual(span["duration"], 1)
+            self.assertEqual(span["localEndpoint"], {"serviceName": "mtp-backend"})
+            self.assertEqual(span["tags"]["channel"], "specific.a!1")
+
+
+class SingleNodeSettingsTest(SimpleTestCase):
+    def load(self, **env):
+        with mock.patch.dict(os.environ, env):
+            return runpy.run_module("mtp_backend.settings")
+
+    def test_single_node(self):
+        settings = self.load(SINGLE_NODE="1", CHANNEL_CAPACITY="7")
+        self.assertEqual(settings["CHANNEL_LAYERS"]["default"]["BACKEND"], "channels.layers.InMemoryChannelLayer")
+        self.assertEqual(settings["CHANNEL_LAYERS"]["default"]["CONFIG"], {"capacity": 7})
+        self.assertEqual(settings["CACHES"]["default"]["BACKEND"], "django.core.cache.backends.locmem.LocMemCache")
+
+    def test_redis(self):
+        settings = self.load(SINGLE_NODE="0", REDIS_CONNECTION_STR="redis://cache:6379", REDIS_SHARDS="")
+        self.assertEqual(settings["CHANNEL_LAYERS"]["default"]["BACKEND"], "channels_redis.core.RedisChannelLayer")
+        self.assertEqual(settings["CHANNEL_LAYERS"]["default"]["CONFIG"]["hosts"], ["redis://cache:6379"])
+        self.assertEqual(settings["CACHES"]["default"],
+                         {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://cache:6379"})
+
+    def test_redis_required(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("REDIS_CONNECTION_STR", None)
+            with self.assertRaises(KeyError):
+                self.load(SINGLE_NODE="0", REDIS_SHARDS="")
+
+
+class SlimImportTest(SimpleTestCase):
+    # In a fresh interpreter, as this one has already imported everything
+    SCRIPT = "import json, sys, mtp_backend.asgi; print(json.dumps(sorted(sys.modules)))"
+
+    def imported(self, slim):
+        env = {**os.environ, "ASGI_SLIM": slim, "DJANGO_SETTINGS_MODULE": "mtp_backend.settings"}
+        result = subprocess.run([sys.executable, "-c", self.SCRIPT], env=env, capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+        return set(json.loads(result.stdout.splitlines()[-1]))
+
+    def test_slim_application(self):
+        modules = self.imported("1")
+        for module in ["channels.auth", "google.auth", "numpy"]:
+            self.assertNotIn(module, modules)
+
+    def test_full_application(self):
+        self.assertIn("channels.auth", self.imported("0"))
+
+
+class CheckpointTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.players = [LobbyEntry("a@x"), LobbyEntry("b@x")]
+        Checkpoint.save("g", self.players, [], None, 3, [1, 2])
+
+    def test_last_player_back_starts(self):
+        self.assertEqual(Checkpoint.join("g", "a@x", "ca")["joined"], {"a@x": "ca"})
+        self.assertEqual(Checkpoint.join("g", "b@x", "cb")["joined"], {"a@x": "ca", "b@x": "cb"})
+        self.assertTrue(Checkpoint.claim("g", self.players))
+        self.assertFalse(Checkpoint.claim("g", self.players))
+        self.assertIsNone(Checkpoint.for_player("a@x"))
+
+        # Handed off again later
+        Checkpoint.save("g", self.players, [], None, 4, [3, 4])
+        self.assertEqual(Checkpoint.join("g", "a@x", "ca2")["joined"], {"a@x": "ca2"})
+        self.assertEqual(Checkpoint.for_player("b@x"), "g")
+
+    def test_concurrent_join(self):
+        barrier, started = threading.Barrier(2), []
+
+        def join(email):
+            barrier.wait()
+            if len(Checkpoint.join("g", email, email)["joined"]) == 2 and Checkpoint.claim("g", self.players):
+                started.append(email)
+
+        threads = [threading.Thread(target=join, args=(p.email,)) for p in self.players]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(started), 1)
+
+    def test_expired(self):
+        cache.clear()
+        self.assertIsNone(Checkpoint.join("g", "a@x", "ca"))
+
+
+class RedisCheckpointTest(RedisCacheMixin, CheckpointTest):
+    pass
+
+
+class ImportPlayersTest(TestCase):
+    def load(self, text):
+        return import_players(io.BytesIO(text.encode()))
+
+    def test_create_and_update(self):
+        create_player("a@x", name="A", hall="H1", upi_id="a@upi", gender="F")
+        created, updated = self.load(
+            "email,name,hall,upi_id,gender\n"
+            " A@X ,Ann,,,\n"
+            "b@x,B,,,\n"
+            "B@x,Bee,H2,,\n"
+            ",nobody,,,\n"
+        )
+        self.assertEqual((created, updated), (1, 1))
+
+        a = Player.objects.get(email="a@x")
+        # Blank cells keep what was there
+        self.assertEqual((a.name, a.hall, a.upi_id, a.gender), ("Ann", "H1", "a@upi", "F"))
+        b = Player.objects.get(email="b@x")
+        self.assertEqual((b.name, b.hall, b.upi_id, b.gender, b.roll_no), ("Bee", "H2", None, "M", ""))
+        self.assertEqual(Player.objects.count(), 2)
+        self.assertEqual(self.load("email,year\nb@x,2\n"), (0, 1))
+
+    def test_email_only(self):
+        create_player("a@x", name="A")
+        self.assertEqual(self.load("email\na@x\nc@x\n"), (1, 0))
+        self.assertEqual(Player.objects.get(email="a@x").name, "A")
+
+    def test_bad_header(self):
+        with self.assertRaises(ValueError):
+            self.load("name\nA\n")
+        with self.assertRaises(ValueError):
+            self.load("email,password\na@x,x\n")
+
+
+class AsyncViewTest(TestCase):
+    info = {"email": "a@x", "name": "A", "picture": "https://a", "iss": "accounts.google.com"}
+    profile = {"hall": "H", "year": "3", "department": "CS", "upi_id": "a@upi", "gender": "F", "roll_no": "1"}
+
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        patcher = mock.patch("api.views.get_user_info_async", mock.AsyncMock(return_value=self.info))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_signup_json_and_form(self):
+        response = await views.signup_or_update_async(
+            self.factory.post("/", json.dumps(self.profile), content_type="application/json"))
+        self.assertEqual(response.status_code, 200)
+        player = await Player.objects.aget(email="a@x")
+        self.assertEqual((player.name, player.hall, player.gender), ("A", "H", "F"))
+
+        response = await views.signup_or_update_async(self.factory.post(
+            "/", urlencode({**self.profile, "hall": "H2"}), content_type="application/x-www-form-urlencoded"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await Player.objects.aget(email="a@x")).hall, "H2")
+
+    async def test_signup_bad_body(self):
+        response = await views.signup_or_update_async(
+            self.factory.post("/", "{not json", content_type="application/json"))
+        self.assertEqual(response.status_code, 400)
+        response = await views.signup_or_update_async(
+            self.factory.post("/", json.dumps({"hall": "H"}), content_type="application/json"))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("year", json.loads(response.content)["detail"])
+        self.assertFalse(await Player.objects.filter(email="a@x").aexists())
+
+    @mock.patch.dict("os.environ", {"ENV": "prod"})
+    async def test_eligible(self):
+        await Player.objects.acreate(email="a@x", name="A")
+        await Player.objects.acreate(email="b@x", name="B")
+        response = await views.is_eligible_async(self.factory.get("/eligible/"))
+        self.assertEqual(json.loads(response.content), {"eligible": True})
+
+        await Session.objects.acreate(group_id="h", server_id="a@x", client_id="b@x",
+                                      ended_at=datetime.now(timezone.utc))
+        response = await views.is_eligible_async(self.factory.get("/eligible/"))
+        self.assertEqual(json.loads(response.content), {"eligible": False})
+
+
+class GoogleTokenTest(SimpleTestCase):
+    def setUp(self):
+        utils._google_certs.update(certs=None, expires=0)
+        self.fetch = mock.patch("api.utils._fetch_google_certs", return_value=({"kid": "cert"}, 60)).start()
+        self.decode = mock.patch("google.auth.jwt.decode").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def user_info(self, iss="https://accounts.google.com"):
+        self.decode.return_value = {"email": "a@x", "iss": iss}
+        return async_to_sync(utils.get_user_info_async)("token")
+
+    def test_issuer(self):
+        self.assertEqual(self.user_info()["email"], "a@x")
+        self.assertEqual(self.decode.call_args.kwargs["certs"], {"kid": "cert"})
+        self.assertIsNone(self.user_info(iss="https://evil.example"))
+
+        self.decode.side_effect = ValueError("bad signature")
+        self.assertIsNone(self.user_info())
+
+    def test_certs_cached(self):
+        self.user_info()
+        self.user_info()
+        self.assertEqual(self.fetch.call_count, 1)
+
+        with mock.patch("api.utils.time.time", return_value=time.time() + 61):
+            self.user_info()
+        self.assertEqual(self.fetch.call_count, 2)
@@ -0,0 +1,39 @@
+import time
+
+
+class TokenBucket:
+    """Allows `rate` messages per second on average, with bursts of up to `burst`"""
+    __slots__ = ("rate", "burst", "tokens", "last")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def consume(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self):
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+
+def backlog(channel_layer):
+    """
+    Messages the channel layer holds in this worker for its consumers, over
+    all channels: the receive buffers of channels_redis, or the queues of the
+    in-memory layer. Grows when the worker falls behind, e.g. with many slow
+    clients, where each channel's capacity only bounds that channel.
+    """
+    queues = getattr(channel_layer, "receive_buffer", None)
+    if queues is None:
+        queues = getattr(channel_layer, "channels", {})
+    # Copied first, as the event loop thread adds and removes channels
+    return sum(queue.qsize() for queue in list(queues.values()))
@@ -0,0 +1,165 @@
+"""
+End-to-end tracing of client messages across channel layer hops. A sampled
+message entering `receive_json` starts a trace; every handler decorated with
+`traced` becomes a span, `stamp` attaches the trace context to messages sent
+on, and the receiving handler records the hop in between as its own span.
+Spans are exported in Zipkin v2 JSON to TRACE_FILE and/or TRACE_COLLECTOR_URL.
+"""
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+
+TRACE_KEY = "trace"
+SERVICE_NAME = "mtp-backend"
+
+_local = threading.local()
+
+
+def _now_us():
+    return int(time.time() * 1_000_000)
+
+
+def _new_id(size=8):
+    return os.urandom(size).hex()
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "end", "tags")
+
+    def __init__(self, trace_id, parent_id, name, start, tags):
+        self.trace_id = trace_id
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = start
+        self.end = None
+        self.tags = tags
+
+    def to_zipkin(self):
+        span = {
+            "traceId": self.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": self.start,
+            "duration": max(self.end - self.start, 1),
+            "localEndpoint": {"serviceName": SERVICE_NAME},
+            "tags": self.tags,
+        }
+        if self.parent_id is not None:
+            span["parentId"] = self.parent_id
+        return span
+
+
+class SpanExporter(threading.Thread):
+    """Writes spans in batches off the consumer threads; drops spans when it can't keep up"""
+
+    def __init__(self, batch_size=100, interval=1.0):
+        super(SpanExporter, self).__init__(daemon=True)
+        self.spans = queue.Queue(maxsize=10000)
+        self.batch_size = batch_size
+        self.interval = interval
+
+    def export(self, span: Span):
+        try:
+            self.spans.put_nowait(span.to_zipkin())
+        except queue.Full:
+            pass
+
+    def run(self):
+        while True:
+            batch = [self.spans.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size and time.monotonic() < deadline:
+                try:
+                    batch.append(self.spans.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception as e:
+                log.error(f"Could not export {len(batch)} spans: {e}")
+
+    @staticmethod
+    def write(batch):
+        if settings.TRACE_FILE:
+            with open(settings.TRACE_FILE, "a") as f:
+                f.writelines(json.dumps(span) + "\n" for span in batch)
+        if settings.TRACE_COLLECTOR_URL:
+            # Only needed with a collector, and kept off the import path of the workers
+            import requests
+            requests.post(settings.TRACE_COLLECTOR_URL, json=batch, timeout=5)
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def export(span: Span):
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = SpanExporter()
+                _exporter.start()
+    _exporter.export(span)
+
+
+def traced(handler=None, *, root=False):
+    """
+    Records `handler` as a span of the trace carried by its message. `root`
+    handlers start a new trace for a TRACE_SAMPLE_RATE fraction of messages.
+    """
+    if handler is None:
+        return functools.partial(traced, root=root)
+
+    @functools.wraps(handler)
+    def wrapper(self, message, *args, **kwargs):
+        incoming = message.pop(TRACE_KEY, None) if isinstance(message, dict) else None
+        tags = {"channel": self.channel_name, "group": str(getattr(self, "group_id", None))}
+
+        if incoming is not None:
+            hop = Span(incoming["trace_id"], incoming["parent_id"], incoming["hop"], incoming["sent_at"], tags)
+            hop.end = _now_us()
+            export(hop)
+            trace_id, parent_id = hop.trace_id, hop.span_id
+        elif root and random.random() < settings.TRACE_SAMPLE_RATE:
+            trace_id, parent_id = _new_id(16), None
+        else:
+            return handler(self, message, *args, **kwargs)
+
+        name = handler.__name__
+        if message.get("type") != name:
+            name = f"{name}:{message.get('type')}"
+
+        span = Span(trace_id, parent_id, name, _now_us(), tags)
+        previous, _local.span = getattr(_local, "span", None), span
+        try:
+            return handler(self, message, *args, **kwargs)
+        finally:
+            _local.span = previous
+            span.end = _now_us()
+            export(span)
+
+    return wrapper
+
+
+def stamp(message, hop):
+    """Attaches the current trace, if any, to a message about to be sent through the channel layer"""
+    span = getattr(_local, "span", None)
+    if span is not None:
+        message[TRACE_KEY] = {
+            "trace_id": span.trace_id,
+            "parent_id": span.span_id,
+            "hop": hop,
+            "sent_at": _now_us()
+        }
+    return message
@@ -0,0 +1,213 @@
+import logging
+import pickle
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .profiling import async_to_sync, timed
+from .utils import random_str
+
+log = logging.getLogger(__name__)
+
+LOBBY = "lobby"
+LOBBY_KEY = "active_channels"
+LOBBY_TTL = 60 * 30
+
+# Moves channels from the lobby into a new group and queues a message on each, as long as the
+# lobby is still the one the match was made from. Mirrors channels_redis' group_add,
+# group_discard and send, plus the cache write of the lobby.
+#   KEYS: lobby cache key, lobby group, new group, then one message key per channel
+#   ARGV: lobby as read, lobby after the move, lobby TTL, now, group expiry, message expiry,
+#         then per channel: name, message, capacity
+TRANSITION_SCRIPT = """
+local n = #KEYS - 3
+local now = tonumber(ARGV[4])
+if (redis.call('GET', KEYS[1]) or '') ~= ARGV[1] then
+    return -1
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+local full = 0
+for i = 1, n do
+    local channel, message, capacity = ARGV[4 + 3 * i], ARGV[5 + 3 * i], tonumber(ARGV[6 + 3 * i])
+    local key = KEYS[3 + i]
+    redis.call('ZREM', KEYS[2], channel)
+    redis.call('ZADD', KEYS[3], now, channel)
+    redis.call('ZREMRANGEBYSCORE', key, 0, math.floor(now) - tonumber(ARGV[6]))
+    if redis.call('ZCOUNT', key, '-inf', '+inf') < capacity then
+        redis.call('ZADD', key, now, message)
+        redis.call('EXPIRE', key, ARGV[6])
+    else
+        full = full + 1
+    end
+end
+redis.call('EXPIRE', KEYS[3], ARGV[5])
+return full
+"""
+
+# Replaces the lobby, as long as it is the one the new lobby was made from.
+#   KEYS: lobby cache key
+#   ARGV: lobby as read, lobby after, lobby TTL
+REPLACE_SCRIPT = """
+if (redis.call('GET', KEYS[1]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+# Takes a channel out of the lobby, as long as the lobby is the one it was read from.
+#   KEYS: lobby cache key, lobby group
+#   ARGV: lobby as read, lobby after, lobby TTL, channel name
+LEAVE_SCRIPT = """
+if (redis.call('GET', KEYS[1]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+redis.call('ZREM', KEYS[2], ARGV[4])
+return 1
+"""
+
+
+def sharded(channel_layer):
+    """Whether the lobby is partitioned over the shards of the layer (see api.sharding)"""
+    return getattr(channel_layer, "sharded", False)
+
+
+def pipelined(channel_layer):
+    """Whether each lobby shares a Redis server with its groups and channels, so transitions can be scripted"""
+    return sharded(channel_layer) or getattr(channel_layer, "ring_size", None) == 1 \
+        and settings.CACHES["default"]["BACKEND"] == "django.core.cache.backends.redis.RedisCache" \
+        and channel_layer.hosts[0].get("address") == settings.CACHES["default"]["LOCATION"]
+
+
+def shards(channel_layer):
+    """Shards with a lobby, this worker's first"""
+    if not sharded(channel_layer):
+        return [0]
+    return [channel_layer.shard] + [i for i in range(channel_layer.ring_size) if i != channel_layer.shard]
+
+
+def lobby_group(channel_layer, shard=None):
+    if not sharded(channel_layer):
+        return LOBBY
+    return channel_layer.lobby_groups[channel_layer.shard if shard is None else shard]
+
+
+def new_group_name(channel_layer, shard=None):
+    """A new group name, placed on `shard` (this worker's by default) when sharded"""
+    return channel_layer.new_group_name(shard) if sharded(channel_layer) else random_str()
+
+
+class LobbySnapshot:
+    """The lobby as read for a match, so that moving the matched players can check it is unchanged"""
+
+    def __init__(self, raw, entries, shard=0):
+        self.raw = raw
+        self.entries = entries
+        self.shard = shard
+
+    def players(self):
+        now = int(datetime.now().timestamp())
+        return {k: v['data'] for k, v in self.entries.items() if v['ttl'] > now}
+
+
+@timed("lobby")
+def read_lobby(channel_layer, shard=None) -> LobbySnapshot:
+    """The lobby of `shard`, this worker's by default"""
+    if not pipelined(channel_layer):
+        return LobbySnapshot(None, cache.get(LOBBY_KEY, {}))
+
+    shard = shards(channel_layer)[0] if shard is None else shard
+
+    async def get():
+        return await channel_layer.connection(shard).get(cache.make_key(LOBBY_KEY))
+
+    raw = async_to_sync(get)()
+    # RedisCache pickles everything but ints
+    return LobbySnapshot(raw or b"", pickle.loads(raw) if raw else {}, shard)
+
+
+@timed("lobby")
+def update_lobby(channel_layer, change):
+    """
+    Replaces this worker's lobby with `change(entries)`, or leaves it if that
+    returns None. On Redis this is a compare-and-set like the transitions,
+    retried with a fresh read if the lobby changed meanwhile, so players a
+    transition just moved out are never written back.
+    """
+    while True:
+        lobby = read_lobby(channel_layer)
+        entries = change(dict(lobby.entries))
+        if entries is None:
+            return
+        if not pipelined(channel_layer):
+            cache.set(LOBBY_KEY, entries, LOBBY_TTL)
+            return
+
+        key = cache.make_key(LOBBY_KEY)
+        args = [lobby.raw, pickle.dumps(entries, pickle.HIGHEST_PROTOCOL), LOBBY_TTL]
+
+        async def run():
+            return await channel_layer.connection(lobby.shard).eval(REPLACE_SCRIPT, 1, key, *args)
+
+        if async_to_sync(run)() == 1:
+            return
+
+
+@timed("lobby")
+def leave_lobby(channel_layer, lobby: LobbySnapshot, channel_name) -> bool:
+    """Takes a channel out of `lobby`. Fails and returns False if the lobby changed since it was read"""
+    entries = {k: v for k, v in lobby.entries.items() if k != channel_name}
+    keys = [cache.make_key(LOBBY_KEY), channel_layer._group_key(lobby_group(channel_layer, lobby.shard))]
+    args = [lobby.raw, pickle.dumps(entries, pickle.HIGHEST_PROTOCOL), LOBBY_TTL, channel_name]
+
+    async def run():
+        return await channel_layer.connection(lobby.shard).eval(LEAVE_SCRIPT, len(keys), *keys, *args)
+
+    return async_to_sync(run)() == 1
+
+
+@timed("lobby")
+def move_to_group(channel_layer, lobby: LobbySnapshot, channel_names, group_id, message) -> bool:
+    """
+    Takes the channels out of the lobby, adds them to `group_id` and sends
+    `message` to them. On Redis this is a single scripted round-trip, which
+    fails and returns False if the lobby changed since `lobby` was read.
+    When sharded, the group must be on the lobby's shard.
+    """
+    if not pipelined(channel_layer):
+        for channel_name in channel_names:
+            async_to_sync(channel_layer.group_discard)(LOBBY, channel_name)
+            async_to_sync(channel_layer.group_add)(group_id, channel_name)
+        entries = cache.get(LOBBY_KEY, {})
+        for channel_name in channel_names:
+            entries.pop(channel_name, None)
+        cache.set(LOBBY_KEY, entries, LOBBY_TTL)
+        async_to_sync(channel_layer.group_send)(group_id, message)
+        return True
+
+    entries = {k: v for k, v in lobby.entries.items() if k not in channel_names}
+    keys = [
+        cache.make_key(LOBBY_KEY),
+        channel_layer._group_key(lobby_group(channel_layer, lobby.shard)),
+        channel_layer._group_key(group_id)
+    ]
+    args = [lobby.raw, pickle.dumps(entries, pickle.HIGHEST_PROTOCOL), LOBBY_TTL,
+            time.time(), channel_layer.group_expiry, int(channel_layer.expiry)]
+    for channel_name in channel_names:
+        keys.append(channel_layer.prefix + channel_layer.non_local_name(channel_name))
+        args += [
+            channel_name,
+            channel_layer.serialize({**message, "__asgi_channel__": channel_name}),
+            channel_layer.get_capacity(channel_name)
+        ]
+
+    async def run():
+        return await channel_layer.connection(lobby.shard).eval(TRANSITION_SCRIPT, len(keys), *keys, *args)
+
+    full = async_to_sync(run)()
+    if full > 0:
+        log.info(f"{full} of {len(channel_names)} channels over capacity in group {group_id}")
+    return full != -1
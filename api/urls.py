@@ -1,8 +1,16 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
-urlpatterns = [
-    path('check/', views.get_user),
-    path('', views.signup_or_update),
-    path('eligible/', views.is_eligible)
-]
+if settings.ASYNC_VIEWS:
+    urlpatterns = [
+        path('check/', views.get_user_async),
+        path('', views.signup_or_update_async),
+        path('eligible/', views.is_eligible_async)
+    ]
+else:
+    urlpatterns = [
+        path('check/', views.get_user),
+        path('', views.signup_or_update),
+        path('eligible/', views.is_eligible)
+    ]
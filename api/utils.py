@@ -1,10 +1,18 @@
 import json
 import os
 import random
+import re
 import string
+import time
 
-from google.auth.transport import requests
-from google.oauth2 import id_token
+from asgiref.sync import sync_to_async
+
+from api.profiling import timed
+
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ["accounts.google.com", "https://accounts.google.com"]
+
+_google_certs = {"certs": None, "expires": 0}
 
 
 def get_user_info(request):
@@ -15,15 +23,56 @@ def get_user_info(request):
     if not token:
         return None
 
+    # google.auth pulls in requests, urllib3 and cryptography, so it is loaded with the first token
+    # rather than at worker startup
+    from google.auth.transport import requests
+    from google.oauth2 import id_token
     try:
         return id_token.verify_oauth2_token(token, requests.Request(), os.environ['CLIENT_ID'])
     except Exception as e:
         return None
 
 
+def _fetch_google_certs():
+    from google.auth.transport import requests
+    response = requests.Request()(url=GOOGLE_CERTS_URL, method="GET")
+    max_age = re.search(r"max-age=(\d+)", response.headers.get("cache-control", ""))
+    return json.loads(response.data), int(max_age.group(1)) if max_age else 3600
+
+
+async def get_google_certs():
+    """Google's signing certs, refetched only once the cached copy expires"""
+    if _google_certs["certs"] is None or _google_certs["expires"] < time.time():
+        certs, max_age = await sync_to_async(_fetch_google_certs)()
+        _google_certs.update(certs=certs, expires=time.time() + max_age)
+    return _google_certs["certs"]
+
+
+async def get_user_info_async(request):
+    """
+    Non-blocking `get_user_info`: the token is checked locally against cached
+    certs instead of fetching them on every call.
+    """
+    if isinstance(request, str):
+        token = request
+    else:
+        header = request.META.get('HTTP_AUTHORIZATION', "").split(" ")
+        token = header[1] if len(header) > 1 else None
+    if not token:
+        return None
+
+    from google.auth import jwt
+    try:
+        info = jwt.decode(token, certs=await get_google_certs(), audience=os.environ['CLIENT_ID'])
+        return info if info["iss"] in GOOGLE_ISSUERS else None
+    except Exception as e:
+        return None
+
+
 def random_str():
     return ''.join(random.choices(string.ascii_lowercase, k=10))
 
 
+@timed("logging")
 def dumps(data):
-    return json.dumps(data, indent=4, default=lambda __o: str(__o.__dict__)) + f"\n{'-' * 10}\n"
+    return json.dumps(data, indent=4, default=lambda __o: str(getattr(__o, "__dict__", __o))) + f"\n{'-' * 10}\n"
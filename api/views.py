@@ -1,11 +1,20 @@
+import json
 import os
 
-from rest_framework.decorators import api_view, authentication_classes
+from django.db import DataError
+from django.http import JsonResponse, HttpResponse, HttpResponseNotAllowed
+from django.http.multipartparser import MultiPartParserError
+from rest_framework.authentication import SessionAuthentication, BasicAuthentication
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, parser_classes
+from rest_framework.pagination import CursorPagination
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from api.authentication import GoogleJWTAuthentication
-from api.models import Player, Game
-from api.serializers import PlayerSerializer
-from api.utils import get_user_info
+from api.models import Player, Game, ChatMessage
+from api.provisioning import import_players
+from api.serializers import PlayerSerializer, ChatMessageSerializer
+from api.utils import get_user_info, get_user_info_async
 
 
 @api_view(['GET'])
@@ -65,3 +74,122 @@ def signup_or_update(request):
     )
 
     return Response(status=200)
+
+
+class ChatCursorPagination(CursorPagination):
+    ordering = 'message_id'
+    page_size = 100
+
+
+@api_view(['GET'])
+@authentication_classes([SessionAuthentication, BasicAuthentication])
+@permission_classes([IsAdminUser])
+def chat_history(request):
+    messages = ChatMessage.objects.all()
+    if 'group_id' in request.query_params:
+        messages = messages.filter(group_id=request.query_params['group_id'])
+
+    paginator = ChatCursorPagination()
+    page = paginator.paginate_queryset(messages, request)
+    return paginator.get_paginated_response(ChatMessageSerializer(page, many=True).data)
+
+
+@api_view(['POST'])
+@authentication_classes([SessionAuthentication, BasicAuthentication])
+@permission_classes([IsAdminUser])
+@parser_classes([MultiPartParser])
+def provision_players(request):
+    """Creates or updates pre-registered players from an uploaded CSV, see api/provisioning.py"""
+    if 'file' not in request.FILES:
+        return Response(data={"detail": "No file uploaded"}, status=400)
+
+    try:
+        created, updated = import_players(request.FILES['file'])
+    except (ValueError, DataError) as e:
+        return Response(data={"detail": str(e)}, status=400)
+
+    return Response(data={"created": created, "updated": updated})
+
+
+# Async counterparts of the views above, selected with the ASYNC_VIEWS setting (see api/urls.py).
+# DRF views are sync only, so these are plain Django views returning the same payloads.
+
+
+def async_api_view(method):
+    def decorator(view):
+        async def wrapped(request, *args, **kwargs):
+            if request.method != method:
+                return HttpResponseNotAllowed([method])
+            return await view(request, *args, **kwargs)
+
+        wrapped.csrf_exempt = True
+        return wrapped
+
+    return decorator
+
+
+@async_api_view('GET')
+async def get_user_async(request):
+    user_info = await get_user_info_async(request)
+    if user_info is None:
+        return JsonResponse(data={"exists": False, "data": None})
+    else:
+        player = await Player.objects.filter(email=user_info['email']).afirst()
+        return JsonResponse(data={
+            "exists": player is not None,
+            "profile": None if player is None else PlayerSerializer(player).data
+        })
+
+
+@async_api_view('GET')
+async def is_eligible_async(request):
+    if os.environ['ENV'] == 'dev':
+        return JsonResponse(data={"eligible": True})
+
+    user_info = await get_user_info_async(request)
+    if user_info is None:
+        return JsonResponse(data={"eligible": False})
+    else:
+        return JsonResponse(data={"eligible": not await Game.aplayer_has_participated(user_info['email'])})
+
+
+SIGNUP_FIELDS = ['hall', 'year', 'department', 'upi_id', 'gender', 'roll_no']
+
+
+def request_data(request):
+    """The parsed body, from JSON, form or multipart like DRF's `request.data`. Raises ValueError if malformed"""
+    if request.content_type == "application/json":
+        data = json.loads(request.body or b"{}")
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object")
+        return data
+    try:
+        return request.POST
+    except MultiPartParserError as e:
+        raise ValueError(str(e))
+
+
+@async_api_view('POST')
+async def signup_or_update_async(request):
+    user_info = await get_user_info_async(request)
+    if user_info is None:
+        return JsonResponse(data={"detail": "User does not exist"}, status=403)
+
+    try:
+        data = request_data(request)
+    except ValueError as e:
+        return JsonResponse(data={"detail": f"Parse error - {e}"}, status=400)
+    missing = [field for field in SIGNUP_FIELDS if field not in data]
+    if missing:
+        return JsonResponse(data={"detail": f"Missing fields: {', '.join(missing)}"}, status=400)
+
+    await Player.objects.aupdate_or_create(
+        email=user_info["email"],
+        defaults={
+            'name': user_info["name"],
+            'avatar': user_info["picture"],
+            **{field: data[field] for field in SIGNUP_FIELDS}
+        }
+    )
+
+    return HttpResponse(status=200)
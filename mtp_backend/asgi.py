@@ -12,19 +12,27 @@ import os
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mtp_backend.settings')
 
 from channels.routing import ProtocolTypeRouter, URLRouter
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 django_asgi_app = get_asgi_application()
 
-from api.middlewares import JwtAuthMiddlewareStack
+from api.middlewares import JwtAuthMiddleware, JwtAuthMiddlewareStack
 from channels.security.websocket import AllowedHostsOriginValidator
-from channels.auth import AuthMiddlewareStack
 import api.routing
+from api.drain import install_signal_handler
+
+if settings.ASGI_SLIM:
+    # Consumers only use the player set by JwtAuthMiddleware, sessions are not installed
+    websocket_app = JwtAuthMiddleware(URLRouter(api.routing.websocket_urlpatterns))
+else:
+    from channels.auth import AuthMiddlewareStack
+
+    websocket_app = AuthMiddlewareStack(JwtAuthMiddlewareStack(URLRouter(api.routing.websocket_urlpatterns)))
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
-    "websocket": AllowedHostsOriginValidator(
-        AuthMiddlewareStack(JwtAuthMiddlewareStack(
-            URLRouter(api.routing.websocket_urlpatterns)))
-    ),
+    "websocket": AllowedHostsOriginValidator(websocket_app),
 })
+
+install_signal_handler()
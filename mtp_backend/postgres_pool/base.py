@@ -0,0 +1,162 @@
+"""
+Postgres backend that keeps a pool of connections per process instead of
+opening a new one (TCP + TLS + auth) whenever Django connects. Django still
+"closes" its connection after every request and every consumer message; here
+that returns it to the pool. Configured with the POOL key of the database
+settings:
+
+* SIZE: connections per process; connecting blocks when all are checked out
+* TIMEOUT: seconds to wait for a free connection before failing
+* MAX_AGE: seconds after which a connection is replaced
+* CHECK_AFTER: connections idle longer than this are checked with `SELECT 1`
+  before being handed out
+"""
+import threading
+import time
+from collections import deque
+
+import psycopg2
+import psycopg2.extras
+from psycopg2 import extensions
+from django.db.backends.postgresql import base, creation
+
+DEFAULT_POOL = {"SIZE": 10, "TIMEOUT": 10, "MAX_AGE": 1800, "CHECK_AFTER": 30}
+
+
+class ConnectionPool:
+    def __init__(self, conn_params, size, timeout, max_age, check_after):
+        self.conn_params = conn_params
+        self.timeout = timeout
+        self.max_age = max_age
+        self.check_after = check_after
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.idle = deque()
+        self.created = {}
+
+    def checkout(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise psycopg2.OperationalError(f"No database connection free after {self.timeout}s")
+        try:
+            while True:
+                with self.lock:
+                    entry = self.idle.pop() if self.idle else None
+                if entry is None:
+                    connection = psycopg2.connect(**self.conn_params)
+                    self.created[connection] = time.monotonic()
+                    return connection
+
+                connection, last_used = entry
+                if self.usable(connection, last_used):
+                    return connection
+                self.discard(connection)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def checkin(self, connection):
+        try:
+            if connection.closed or connection.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                self.discard(connection)
+                return
+            if connection.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            with self.lock:
+                self.idle.append((connection, time.monotonic()))
+        except psycopg2.Error:
+            self.discard(connection)
+        finally:
+            self.slots.release()
+
+    def usable(self, connection, last_used):
+        now = time.monotonic()
+        if connection.closed or now - self.created.get(connection, now) > self.max_age:
+            return False
+        if now - last_used < self.check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def close_idle(self):
+        with self.lock:
+            idle, self.idle = list(self.idle), deque()
+        for connection, _ in idle:
+            self.discard(connection)
+
+    def discard(self, connection):
+        self.created.pop(connection, None)
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+
+# Keyed by connection parameters, so that a database wrapper whose settings change (like the test
+# runner's switch to the test database) gets connections to the new database
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool_key(conn_params):
+    return tuple(sorted((k, repr(v)) for k, v in conn_params.items()))
+
+
+def close_pools(database):
+    """Closes the idle connections to `database` and forgets its pools, e.g. before it is dropped"""
+    with _pools_lock:
+        keys = [k for k, pool in _pools.items() if pool.conn_params.get("database") == database]
+        pools = [_pools.pop(k) for k in keys]
+    for pool in pools:
+        pool.close_idle()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle pooled connections would keep the test database from being dropped
+        close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_pool(self, conn_params):
+        key = pool_key(conn_params)
+        with _pools_lock:
+            if key not in _pools:
+                options = {**DEFAULT_POOL, **self.settings_dict.get("POOL", {})}
+                _pools[key] = ConnectionPool(
+                    conn_params,
+                    size=options["SIZE"],
+                    timeout=options["TIMEOUT"],
+                    max_age=options["MAX_AGE"],
+                    check_after=options["CHECK_AFTER"]
+                )
+            return _pools[key]
+
+    def get_new_connection(self, conn_params):
+        # Connections go back to the pool they came from, even if the settings changed meanwhile
+        self.pool = self.get_pool(conn_params)
+        connection = self.pool.checkout()
+
+        # Same setup as the stock backend, reapplied as pooled connections are reused
+        options = self.settings_dict["OPTIONS"]
+        try:
+            self.isolation_level = options["isolation_level"]
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.checkin(self.connection)
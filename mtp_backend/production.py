@@ -21,6 +21,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
+if ASGI_SLIM:
+    MIDDLEWARE = [m for m in MIDDLEWARE if m not in SLIM_EXCLUDED]
 
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
@@ -29,10 +31,11 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 # username (not @sever-name).
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'mtp_backend.postgres_pool',
         'NAME': os.environ['DBNAME'],
         'HOST': os.environ['DBHOST'],
         'USER': os.environ['DBUSER'],
-        'PASSWORD': os.environ['DBPASS']
+        'PASSWORD': os.environ['DBPASS'],
+        'POOL': DB_POOL
     }
 }
@@ -52,22 +52,125 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Slim profile for the ASGI workers: only the player API, chat history and websockets are served, without
+# the admin, sessions, messages and static files, so workers start faster. Run management commands and
+# the admin without it
+ASGI_SLIM = os.environ.get("ASGI_SLIM", "0") == "1"
+SLIM_EXCLUDED = [
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+]
+
+if ASGI_SLIM:
+    INSTALLED_APPS = [a for a in INSTALLED_APPS if a not in SLIM_EXCLUDED]
+    MIDDLEWARE = [m for m in MIDDLEWARE if m not in SLIM_EXCLUDED]
+
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
 
 ASGI_APPLICATION = "mtp_backend.asgi.application"
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
-        "CONFIG": {
-            "hosts": [os.environ["REDIS_CONNECTION_STR"]],
+# Single-node mode keeps the channel layer and the lobby cache in process, so Redis is not needed.
+# Only valid with a single worker process (`gunicorn -w 1`), as nothing is shared between processes.
+SINGLE_NODE = os.environ.get("SINGLE_NODE", "0") == "1"
+
+# Redis servers to shard the channel layer and the lobby over, comma separated (see api/sharding.py).
+# Each worker process uses the shard REDIS_SHARD, or its pid modulo the number of shards.
+# The cache, with admission counts, the waiting room and checkpoints, stays on REDIS_CONNECTION_STR
+REDIS_SHARDS = [s for s in os.environ.get("REDIS_SHARDS", "").split(",") if s]
+
+if SINGLE_NODE:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+            "CONFIG": {
+                "capacity": int(os.environ.get("CHANNEL_CAPACITY", 100)),
+            },
         },
-    },
+    }
+elif len(REDIS_SHARDS) > 1:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "api.sharding.ShardedChannelLayer",
+            "CONFIG": {
+                "hosts": REDIS_SHARDS,
+                "shard": int(os.environ["REDIS_SHARD"]) if os.environ.get("REDIS_SHARD") else None,
+                "capacity": int(os.environ.get("CHANNEL_CAPACITY", 100)),
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [os.environ["REDIS_CONNECTION_STR"]],
+                "capacity": int(os.environ.get("CHANNEL_CAPACITY", 100)),
+            },
+        },
+    }
+
+# Per-connection token buckets for client messages: message class -> (messages per second, burst)
+MESSAGE_RATE_LIMITS = {
+    "chat": (2, 10),
+    "signaling": (50, 200),
+    "image": (0.5, 3),
+    "game": (5, 20),
+}
+
+# Messages queued in a worker for its consumers, over all its channels, beyond which its clients' messages are dropped
+WORKER_BACKLOG_LIMIT = int(os.environ.get("WORKER_BACKLOG_LIMIT", 1000))
+
+# Seconds clients are told to wait when a message is dropped for a channel at CHANNEL_CAPACITY or a busy worker
+CHANNEL_FULL_RETRY_AFTER = 0.5
+
+# Consumer handlers slower than this are logged with a breakdown of where the time went
+SLOW_MESSAGE_MS = float(os.environ.get("SLOW_MESSAGE_MS", 200))
+# Where profiles of connections sampled with PROFILE_SAMPLE_RATE are written, logged if unset
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+
+# Fraction of client messages traced across channel layer hops. Spans are written as Zipkin v2 JSON
+# lines to TRACE_FILE and/or posted to a Zipkin-compatible collector at TRACE_COLLECTOR_URL
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0))
+TRACE_FILE = os.environ.get("TRACE_FILE")
+TRACE_COLLECTOR_URL = os.environ.get("TRACE_COLLECTOR_URL")
+
+# Seconds a player waits in the lobby before being matched with a bot, unset to disable bots
+BOT_MATCH_AFTER = float(os.environ["BOT_MATCH_AFTER"]) if os.environ.get("BOT_MATCH_AFTER") else None
+# One of api.bots.STRATEGIES
+BOT_STRATEGY = os.environ.get("BOT_STRATEGY", "tit_for_tat")
+
+# Caps on admitted players (in the lobby or a game) and on the lobby, per worker process and cluster-wide.
+# Unset means unlimited. Players over a cap wait in a FIFO waiting room, and connects are refused
+# once WAITING_ROOM players are waiting
+ADMISSION_LIMITS = {
+    key: int(os.environ[f"MAX_{key}"]) if os.environ.get(f"MAX_{key}") else None
+    for key in ["WORKER_CONNECTIONS", "WORKER_LOBBY", "CLUSTER_CONNECTIONS", "CLUSTER_LOBBY", "WAITING_ROOM"]
 }
 
+# Signal that makes a worker process drain: lobby players are sent elsewhere and games are handed
+# off after their current round. Empty to disable
+DRAIN_SIGNAL = os.environ.get("DRAIN_SIGNAL", "SIGUSR2") or None
+
+# Players per group. Above 2, the lobby forms groups of this size that play GROUP_GAME (see api.games.GROUP_GAME_MAP)
+GROUP_SIZE = int(os.environ.get("GROUP_SIZE", 2))
+GROUP_GAME = os.environ.get("GROUP_GAME", "public_goods")
+
+# Chat messages are written in bulk once this many are pending or the oldest is this many seconds old
+CHAT_FLUSH_SIZE = 100
+CHAT_FLUSH_INTERVAL = 10
+
 ROOT_URLCONF = 'mtp_backend.urls'
 
+# Serve the player endpoints with the async views instead of the DRF ones
+ASYNC_VIEWS = os.environ.get("ASYNC_VIEWS", "0") == "1"
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -89,23 +192,39 @@ WSGI_APPLICATION = 'mtp_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# Connections are pooled per worker process, see mtp_backend/postgres_pool
+DB_POOL = {
+    'SIZE': int(os.environ.get('DB_POOL_SIZE', 10)),
+    'TIMEOUT': 10,
+    'MAX_AGE': 1800,
+    'CHECK_AFTER': 30,
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'mtp_backend.postgres_pool',
         'NAME': os.environ['DBNAME'],
         'HOST': os.environ['DBHOST'],
         'USER': os.environ['DBUSER'],
         'PASSWORD': os.environ['DBPASS'],
-        'PORT': '5432'
+        'PORT': '5432',
+        'POOL': DB_POOL
     }
 }
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
-        'LOCATION': os.environ["REDIS_CONNECTION_STR"],
+if SINGLE_NODE:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ["REDIS_CONNECTION_STR"],
+        }
     }
-}
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -141,6 +260,12 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Archived round partitions, see `archive_rounds`. Mapped to a fileshare on Azure.
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "/backup")
+
+# Per-month stats of `analyze_rounds`, kept between runs so only months with new rounds are loaded
+ANALYSIS_STATE_FILE = os.environ.get("ANALYSIS_STATE_FILE", os.path.join(BACKUP_DIR, "analysis", "round_stats.pickle"))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -13,7 +13,7 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.conf import settings
 from django.urls import include, path
 
 from api import views
@@ -21,6 +21,15 @@ from api import views
 urlpatterns = [
     path('player/', include('api.urls')),
     path('status/', views.status),
-    path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
-    path('admin/', admin.site.urls)
+    path('chat/', views.chat_history),
+    path('provision/', views.provision_players),
 ]
+
+# The login views and the admin need sessions, which the slim profile leaves out
+if not settings.ASGI_SLIM:
+    from django.contrib import admin
+
+    urlpatterns += [
+        path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
+        path('admin/', admin.site.urls)
+    ]